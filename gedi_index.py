@@ -0,0 +1,58 @@
+from pipeline.indexer import GEDIIndexer
+
+import os
+import argparse
+
+# --------------------------COMMAND LINE ARGUMENTS AND ERROR HANDLING---------------------------- #
+# Set up argument and error handling
+parser = argparse.ArgumentParser(description='Builds and queries the footprint index over the subsetted GEDI files saved by the pipeline.')
+
+parser.add_argument('command', choices=['build', 'query'], help='"build" indexes new and changed subsetted files of "--dir"; \
+                    "query" saves the indexed footprints inside "--roi" and between "--start" and "--end" to "--output".')
+
+parser.add_argument('--dir', required=True, help='Local directory with the subsetted GEDI files (.gpkg).')
+
+parser.add_argument('--index', required=False, help='Filepath to the index database (default is "[dir]/gedi_index.sqlite").', default=None)
+
+parser.add_argument('--tile_size', required=False, help='Size in degrees of the index grid tiles, used when the index is created (default is 0.05).',
+                    type=float, default=0.05)
+
+parser.add_argument('--roi', required=False, help='Region of interest (ROI) of the query. Valid inputs are bounding box coordinates: ul_lat,ul_lon,lr_lat,lr_lon \
+                    or a filepath to a vector file (e.g. .gpkg, .shp, .geojson) with the polygons of the ROI.', default=None)
+
+parser.add_argument('--start', required=False, help='Start date of the query: valid format is yyyy.mm.dd (e.g. 2020.11.12).', default=None)
+
+parser.add_argument('--end', required=False, help='End date of the query: valid format is yyyy.mm.dd (e.g. 2021.07.01).', default=None)
+
+parser.add_argument('--output', required=False, help='Filepath to save the footprints returned by the query (default is "query.gpkg" in "--dir").', default=None)
+
+args = parser.parse_args()
+
+# ------------------------------------------------------------------------------------#
+
+indexer = GEDIIndexer(directory=args.dir, index_path=args.index, tile_size=args.tile_size)
+
+if args.command == 'build':
+    indexer.update()
+    exit(0)
+
+if args.roi is None:
+    parser.error('"--roi" is required for the "query" command.')
+
+roi = args.roi
+if os.path.exists(roi):
+    import geopandas as gp
+
+    # ROI from vector file, merged to a single geometry (union_all replaces unary_union in geopandas 1.0)
+    geometry = gp.read_file(roi).to_crs('EPSG:4326').geometry
+    roi = geometry.union_all() if hasattr(geometry, 'union_all') else geometry.unary_union
+
+footprints = indexer.query(roi, date_start=args.start, date_end=args.end)
+
+if footprints is None:
+    print("[Indexer] No footprints found for the query.")
+    exit(0)
+
+output = args.output if args.output is not None else os.path.join(args.dir, "query.gpkg")
+footprints.to_file(output, driver='GPKG')
+print(f"[Indexer] Saved {footprints.shape[0]} footprints to: {output}")
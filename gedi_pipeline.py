@@ -1,5 +1,4 @@
 from pipeline.pipeline import GEDIPipeline
-from utils.service_status import get_service_status
 
 import argparse
 
@@ -36,13 +35,54 @@ parser.add_argument('--login_keep', required=False, help='Include this option to
 
 parser.add_argument('--keep_original_file', required=False, help='Include this option to GEDIPipeline and instruct it to not delete the downloaded HDF5 files from LPDAAC.', action='store_true')
 
+parser.add_argument('--plan', required=False, help='Include this option to only list the granules to process, the estimated download size and \
+                    the granules already subsetted, without logging in to EarthData, downloading or subsetting.', action='store_true')
+
+parser.add_argument('--in_memory', required=False, help='Include this option to download each granule to memory and subset it from there, without writing \
+                    the HDF5 file to disk. Granules larger than "--memory_budget" are downloaded to disk. Ignored with "--keep_original_file".', action='store_true')
+
+parser.add_argument('--memory_budget', required=False, help='Memory budget in MB for a granule downloaded with "--in_memory" (default is 2048).', type=float, default=2048)
+
+parser.add_argument('--retries', required=False, help='Number of retries for each failed request to CMR or the Data Repository, with exponential backoff. \
+                    Interrupted granule downloads are also restarted up to this number of times (default is 5).', type=int, default=5)
+
+parser.add_argument('--rate_limit', required=False, help='Maximum number of requests per second sent to each host (default is no limit).', type=float, default=None)
+
+parser.add_argument('--build_index', required=False, help='Include this option to add every subsetted file to the footprint index of "--dir", \
+                    which can be queried with the "gedi_index.py" script.', action='store_true')
+
+parser.add_argument('--aggregate', required=False, help='Subset variables to aggregate to a grid over the ROI, separated by commas (e.g. agbd,rh_98). \
+                    The count, mean, standard deviation, min and max of each grid cell are updated after each granule is subsetted.', default=None)
+
+parser.add_argument('--resolution', required=False, help='Size in degrees of the grid cells used with "--aggregate" (default is 0.01, about 1 km).', type=float, default=0.01)
+
+parser.add_argument('--aggregate_output', required=False, help='Filepath to save the grid statistics used with "--aggregate", as a NumPy .npz file \
+                    or a GeoTIFF .tif file (requires rasterio). Default is "[dir]/gedi_aggregate.npz".', default=None)
+
+parser.add_argument('--disk_budget', required=False, help='Maximum disk space in MB used by the downloaded granules in "--dir". Downloads pause \
+                    when the budget is exhausted and granules that fit go first (default is no budget).', type=float, default=None)
+
+parser.add_argument('--min_free_space', required=False, help='Disk space in MB to always keep free in "--dir", used with "--disk_budget" (default is 1024).',
+                    type=float, default=1024)
+
+parser.add_argument('--admission_timeout', required=False, help='Maximum seconds to wait for disk space to download a granule, used with "--disk_budget". \
+                    Granules still not admitted are skipped (default is 3600).', type=float, default=3600)
+
+parser.add_argument('--worker', required=False, help='Include this option to run as one of many cooperative workers. Each worker claims granules from a shared \
+                    queue, downloads and subsets them, and stops when the queue is empty. Workers may run on several machines sharing "--dir".', action='store_true')
+
+parser.add_argument('--queue_dir', required=False, help='Directory of the shared work queue used with "--worker" (default is "[dir]/.queue").', default=None)
+
+parser.add_argument('--worker_id', required=False, help='Unique name of this worker used with "--worker" (default is hostname-pid).', default=None)
+
+parser.add_argument('--lease', required=False, help='Seconds a granule claimed by a worker stays leased without a heartbeat before \
+                    it is reclaimed by another worker (default is 600).', type=float, default=600)
+
 
 args = parser.parse_args()
 
 # ------------------------------------------------------------------------------------#
 
-nots = get_service_status(args.product)
-
 pipeline = GEDIPipeline(
     out_directory = args.dir,
     product = args.product,
@@ -54,13 +94,31 @@ pipeline = GEDIPipeline(
     beams = args.beams,
     sds = args.sds,
     persist_login = args.login_keep,
-    keep_original_file=args.keep_original_file
+    keep_original_file=args.keep_original_file,
+    in_memory=args.in_memory,
+    memory_budget=args.memory_budget,
+    max_retries=args.retries,
+    rate_limit=args.rate_limit,
+    build_index=args.build_index,
+    aggregate=args.aggregate,
+    aggregate_resolution=args.resolution,
+    aggregate_output=args.aggregate_output,
+    disk_budget=args.disk_budget,
+    min_free_space=args.min_free_space,
+    admission_timeout=args.admission_timeout
 )
 
+if args.plan:
+    pipeline.plan()
+    exit(0)
+
 print("[Pipeline] Pipeline set, starting ...")
 
 try:
-    granules = pipeline.run_pipeline()
+    if args.worker:
+        granules = pipeline.run_worker(queue_dir=args.queue_dir, worker_id=args.worker_id, lease_seconds=args.lease)
+    else:
+        granules = pipeline.run_pipeline()
 except Exception as e:
     print("[Pipeline] Failed to complete running the Pipeline. See the error below for more information.")
     print(e)
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import shutil
+import threading
+
+from utils.locks import owner, read_owner, remove_if_stale, acquire_lock, release_lock
+
+"""
+Disk space admission control for the granules downloaded by the pipeline.
+"""
+
+class GEDIDiskBudget:
+    """
+    The GEDIDiskBudget :class: admits granule downloads against a disk budget, so the downloaded granules never fill the disk.
+
+    Before downloading, the pipeline reserves the (CMR) size of the granule. A reservation is admitted if the granule files
+    in the directory plus the part of the reservations not yet written to disk stay within the budget, and the disk keeps
+    at least 'min_free' bytes free. Reservations are small files in '[directory]/.reservations', so workers sharing the
+    directory (see GEDIWorkQueue) share the same budget.
+
+    Each reservation records its owner (hostname and process id) and is kept alive by a heartbeat while the download
+    runs. Reservations of processes that stopped (or without a heartbeat for 'stale_seconds') are dropped.
+
+    Args:
+        directory: Directory where the granules are downloaded.
+        budget: Maximum disk space in bytes used by the downloaded granule (.h5) files, including the ones kept
+                with 'keep_original_file'. If None, only the free space is checked.
+        min_free: Disk space in bytes to always keep free. Defaults to 1 GB.
+        stale_seconds: Seconds without a heartbeat after which a reservation of another host is dropped. Defaults to 600 seconds.
+
+    Example:
+        disk = GEDIDiskBudget(directory='some_path', budget=20e9)
+        if disk.reserve('[filename].h5', size, timeout=600):
+            ...  # download, subset and delete the granule
+            disk.release('[filename].h5')
+    """
+
+    def __init__(self, directory, budget=None, min_free=1e9, stale_seconds=600):
+        self.directory = directory
+        self.budget = float(budget) if budget is not None else None
+        self.min_free = float(min_free)
+        self.stale_seconds = float(stale_seconds)
+        self.reservations_dir = os.path.join(directory, ".reservations")
+        self.lock_path = os.path.join(self.reservations_dir, "lock")
+
+        self._held = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+        os.makedirs(self.reservations_dir, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.reservations_dir, f"{name}.res")
+
+    def _reservations(self):
+        """
+        Returns a dict {filename: reserved bytes} with all the reservations in the directory,
+        dropping the reservations left by processes that stopped.
+        """
+        reservations = {}
+        for f in os.listdir(self.reservations_dir):
+            if not f.endswith(".res"):
+                continue
+
+            path = os.path.join(self.reservations_dir, f)
+            if remove_if_stale(path, self.stale_seconds):
+                print(f"[Disk] Dropped the reservation of {f[:-len('.res')]} left by a stopped process.")
+                continue
+
+            try:
+                info = read_owner(path)
+                reservations[f[:-len(".res")]] = float(info["size"])
+            except (FileNotFoundError, TypeError, KeyError, ValueError):
+                continue
+        return reservations
+
+    def _outstanding(self, reservations):
+        """
+        Returns the reserved bytes not yet written to disk by the downloads in progress.
+        """
+        outstanding = 0
+        for name, size in reservations.items():
+            path = os.path.join(self.directory, name)
+            written = os.path.getsize(path) if os.path.exists(path) else 0
+            outstanding += max(0, size - written)
+        return outstanding
+
+    def can_ever_fit(self, size):
+        """
+        Checks if a granule of 'size' bytes fits in the budget at all.
+        """
+        return self.budget is None or size <= self.budget
+
+    def _used(self, name=None):
+        """
+        Returns the bytes used by the granule files in the directory, except the granule 'name'.
+        """
+        return sum(os.path.getsize(os.path.join(self.directory, f)) for f in os.listdir(self.directory)
+                   if f.startswith("GEDI") and f.endswith(".h5") and f != name)
+
+    def fits(self, size, reservations=None, name=None):
+        """
+        Checks if a granule of 'size' bytes can be admitted now. If the granule 'name' is partially downloaded,
+        its file is not counted twice.
+        """
+        reservations = reservations if reservations is not None else self._reservations()
+
+        outstanding = self._outstanding(reservations)
+
+        if self.budget is not None:
+            if self._used(name) + outstanding + size > self.budget:
+                return False
+
+        free = shutil.disk_usage(self.directory).free - outstanding
+        return free - size >= self.min_free
+
+    def is_exhausted(self, size):
+        """
+        Checks if a granule of 'size' bytes can not be admitted until granule files are removed from the directory:
+        no downloads are in progress and the granule files in the directory alone exhaust the budget
+        (e.g. the ones kept with 'keep_original_file').
+        """
+        return self.budget is not None and not self._reservations() and self._used() + size > self.budget
+
+    def try_reserve(self, name, size):
+        """
+        Reserves 'size' bytes for the granule 'name' if it can be admitted now. Returns True if reserved.
+        """
+        acquire_lock(self.lock_path)
+        try:
+            reservations = self._reservations()
+            if name in reservations and name not in self._held:
+                return False
+            if name not in reservations and not self.fits(size, reservations, name):
+                return False
+
+            with open(self._path(name), "w") as rf:
+                json.dump(owner(size=float(size)), rf)
+        finally:
+            release_lock(self.lock_path)
+
+        with self._lock:
+            self._held.add(name)
+        self._start_heartbeat()
+        return True
+
+    def reserve(self, name, size, timeout=None, poll_seconds=10):
+        """
+        Reserves 'size' bytes for the granule 'name', pausing until enough disk space is available.
+
+        Args:
+            timeout: Maximum seconds to wait for disk space. If None, waits forever.
+        Returns:
+            True if reserved, False if the granule does not fit in the budget or the timeout expired.
+        """
+        if not self.can_ever_fit(size):
+            print(f"[Disk] Granule {name} ({size / 1e6:.1f} MB) is larger than the disk budget ({self.budget / 1e6:.1f} MB).")
+            return False
+
+        start = time.time()
+        waiting = False
+        while not self.try_reserve(name, size):
+            if timeout is not None and time.time() - start >= timeout:
+                print(f"[Disk] No disk space for granule {name} ({size / 1e6:.1f} MB) after {timeout:.0f} seconds.")
+                return False
+            if not waiting:
+                print(f"[Disk] Disk budget exhausted. Pausing download of {name} ({size / 1e6:.1f} MB) until space is available...")
+                waiting = True
+            time.sleep(poll_seconds)
+
+        return True
+
+    def release(self, name):
+        """
+        Releases the reservation of the granule 'name', once it is downloaded (or the download failed).
+        """
+        with self._lock:
+            self._held.discard(name)
+
+        try:
+            os.remove(self._path(name))
+        except FileNotFoundError:
+            pass
+
+    def wait_for(self, size, timeout=None, poll_seconds=10):
+        """
+        Pauses until a granule of 'size' bytes can be admitted. Returns False if the timeout expired first.
+        """
+        start = time.time()
+        while not self.fits(size):
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            time.sleep(poll_seconds)
+        return True
+
+    def _start_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        # Touch the reservations held by this process, so other hosts do not drop them
+        while not self._stop.wait(self.stale_seconds / 3):
+            with self._lock:
+                names = list(self._held)
+            for name in names:
+                try:
+                    os.utime(self._path(name))
+                except FileNotFoundError:
+                    with self._lock:
+                        self._held.discard(name)
+
+    def close(self):
+        """
+        Stops the heartbeat thread. Reservations still held are left to go stale and be dropped.
+        """
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
@@ -0,0 +1,176 @@
+import numpy as np
+
+"""
+Streaming aggregation of the subsetted footprints to gridded (raster) statistics.
+"""
+
+# Statistics accumulated for each grid cell, from which the mean and standard deviation are derived
+accumulators = ['count', 'sum', 'sumsq', 'min', 'max']
+
+def check_output(path):
+    """
+    Checks the dependencies needed to save the grid statistics to 'path' are installed, so a missing dependency
+    fails before any granule is processed instead of when the statistics are saved.
+    """
+    if path.endswith(".tif") or path.endswith(".tiff"):
+        try:
+            import rasterio
+        except ImportError:
+            raise ImportError(f"[Aggregator] Saving the grid statistics to a GeoTIFF (\"{path}\") requires rasterio. "
+                              "Install it, or save to a '.npz' file instead.") from None
+
+class GEDIAggregator:
+    """
+    The GEDIAggregator :class: reduces the footprints of subsetted granules to per-cell statistics of a regular grid over the ROI.
+    Running accumulators (count, sum, sum of squares, min and max) are updated granule by granule with vectorized binning,
+    so the memory needed does not depend on the number of footprints, only on the size of the grid.
+
+    Args:
+        roi: Region of Interest covered by the grid. Coordinates must be in WG84 EPSG:4326 and organized as follows: [UL_Lat, UL_Lon, LR_Lat, LR_Lon]
+        variables: List (or comma separated string) of the subset columns to aggregate (e.g. ['agbd', 'rh_98']).
+        resolution: Size of the grid cells in degrees. Defaults to 0.01 degrees (about 1 km).
+        nodata: Value of the footprints to ignore (GEDI fill value). Defaults to -9999.
+
+    Example:
+        aggregator = GEDIAggregator(roi=[.., .., .., ..], variables=['agbd'], resolution=0.01)
+        aggregator.update(subset_df)  # For each subsetted granule
+        aggregator.save('agbd_1km.tif')
+        stats = aggregator.statistics()
+        stats['agbd']['mean']
+        >>> array([[...]])
+    """
+
+    def __init__(self, roi, variables, resolution=0.01, nodata=-9999):
+        self.roi = [float(c) for c in roi]
+        self.variables = variables.split(",") if isinstance(variables, str) else list(variables)
+        self.resolution = float(resolution)
+        self.nodata = nodata
+
+        # Grid origin is the upper left corner of the ROI, rows go from north to south
+        self.x0, self.y0 = self.roi[1], self.roi[0]
+        self.width = int(np.ceil(round((self.roi[3] - self.roi[1]) / self.resolution, 9)))
+        self.height = int(np.ceil(round((self.roi[0] - self.roi[2]) / self.resolution, 9)))
+
+        shape = (len(self.variables), self.height * self.width)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.sum = np.zeros(shape, dtype=np.float64)
+        self.sumsq = np.zeros(shape, dtype=np.float64)
+        self.min = np.full(shape, np.inf, dtype=np.float64)
+        self.max = np.full(shape, -np.inf, dtype=np.float64)
+
+    def _cells(self, lons, lats):
+        """
+        Returns the flat grid cell index of each coordinate, and a mask of the coordinates inside the grid.
+        """
+        col = np.floor((lons - self.x0) / self.resolution).astype(np.int64)
+        row = np.floor((self.y0 - lats) / self.resolution).astype(np.int64)
+        inside = (col >= 0) & (col < self.width) & (row >= 0) & (row < self.height)
+        return row * self.width + col, inside
+
+    def update(self, subset_df):
+        """
+        Adds the footprints of a subsetted granule (GeoPandas dataframe returned by the GEDISubsetter) to the accumulators.
+        Returns the number of footprints inside the grid.
+        """
+        if subset_df is None or subset_df.shape[0] == 0:
+            return 0
+
+        cells, inside = self._cells(subset_df.geometry.x.to_numpy(), subset_df.geometry.y.to_numpy())
+        n_cells = self.height * self.width
+
+        for i, var in enumerate(self.variables):
+            if var not in subset_df.columns:
+                print(f"[Aggregator] Variable {var} not found in subset. Skipping...")
+                continue
+
+            values = subset_df[var].to_numpy(dtype=np.float64)
+            valid = inside & np.isfinite(values)
+            if self.nodata is not None:
+                valid &= values != self.nodata
+
+            c, v = cells[valid], values[valid]
+            self.count[i] += np.bincount(c, minlength=n_cells)
+            self.sum[i] += np.bincount(c, weights=v, minlength=n_cells)
+            self.sumsq[i] += np.bincount(c, weights=v * v, minlength=n_cells)
+            np.minimum.at(self.min[i], c, v)
+            np.maximum.at(self.max[i], c, v)
+
+        return int(inside.sum())
+
+    def merge(self, other):
+        """
+        Adds the accumulators of another GEDIAggregator with the same grid and variables (e.g. from another worker).
+        """
+        if (other.variables != self.variables or other.resolution != self.resolution
+                or (other.x0, other.y0, other.width, other.height) != (self.x0, self.y0, self.width, self.height)):
+            raise ValueError("[Aggregator] Cannot merge aggregators with different grids or variables.")
+
+        self.count += other.count
+        self.sum += other.sum
+        self.sumsq += other.sumsq
+        np.minimum(self.min, other.min, out=self.min)
+        np.maximum(self.max, other.max, out=self.max)
+
+    def statistics(self):
+        """
+        Returns a dict {variable: {statistic: 2D array}} with the 'count', 'mean', 'std' (population standard deviation), 'min' and 'max' of each grid cell.
+        Cells without footprints are NaN (0 for 'count').
+        """
+        stats = {}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for i, var in enumerate(self.variables):
+                empty = self.count[i] == 0
+                mean = self.sum[i] / self.count[i]
+                var_ = np.maximum(self.sumsq[i] / self.count[i] - mean * mean, 0)
+
+                stats[var] = {
+                    'count': self.count[i],
+                    'mean': mean,
+                    'std': np.sqrt(var_),
+                    'min': np.where(empty, np.nan, self.min[i]),
+                    'max': np.where(empty, np.nan, self.max[i]),
+                }
+                stats[var] = {k: v.reshape(self.height, self.width) for k, v in stats[var].items()}
+        return stats
+
+    def save(self, path):
+        """
+        Saves the grid statistics. If 'path' ends with '.tif', saves a GeoTIFF with one band per variable and statistic
+        (requires rasterio). Otherwise, saves a NumPy '.npz' file with the statistics, the raw accumulators and the grid,
+        which can be loaded back with GEDIAggregator.load.
+        """
+        stats = self.statistics()
+
+        if path.endswith(".tif") or path.endswith(".tiff"):
+            import rasterio
+            from rasterio.transform import from_origin
+
+            bands = [(f"{var}_{s}", a) for var in self.variables for s, a in stats[var].items()]
+
+            with rasterio.open(path, "w", driver="GTiff", width=self.width, height=self.height, count=len(bands),
+                               dtype="float64", crs="EPSG:4326", nodata=np.nan,
+                               transform=from_origin(self.x0, self.y0, self.resolution, self.resolution)) as raster:
+                for b, (name, array) in enumerate(bands, start=1):
+                    raster.write(array.astype(np.float64), b)
+                    raster.set_band_description(b, name)
+        else:
+            arrays = {f"{var}_{s}": a for var in self.variables for s, a in stats[var].items()}
+            arrays.update({a: getattr(self, a) for a in accumulators})
+            np.savez_compressed(path, roi=self.roi, variables=self.variables, resolution=self.resolution,
+                                nodata=np.nan if self.nodata is None else self.nodata, **arrays)
+
+        print(f"[Aggregator] Grid statistics ({self.height}x{self.width} cells) saved at: {path}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an aggregator saved to a '.npz' file, so it can be updated further or merged with others.
+        """
+        data = np.load(path)
+        nodata = float(data['nodata'])
+
+        aggregator = cls(roi=data['roi'].tolist(), variables=data['variables'].tolist(), resolution=float(data['resolution']),
+                         nodata=None if np.isnan(nodata) else nodata)
+        for a in accumulators:
+            setattr(aggregator, a, data[a])
+        return aggregator
@@ -1,8 +1,11 @@
+import io
 import os
+import time
 import requests
 import getpass
 from tqdm import tqdm
-import earthaccess
+
+from utils.retry import RetryPolicy, AuthenticationError, RetryError
 
 class SessionNASA(requests.Session):
 	"""
@@ -65,25 +68,79 @@ class GEDIDownloader:
 		persist_login: Choice to persist login and save to a .netrc file. See Earthdata Access API for more info:
 					   https://earthaccess.readthedocs.io/en/latest/howto/authenticate/
 		save_path: Absolute path to save the downloaded files. If None, saves to current working directory (script).
+		retry_policy: RetryPolicy used for the download requests. If None, uses a RetryPolicy with default settings.
+		product: GEDI product downloaded, used to print the service status of its Data Repository before logging in.
 	"""
 
-	def __init__(self, persist_login=False, save_path=None):
+	def __init__(self, persist_login=False, save_path=None, retry_policy=None, product=None):
 		self.save_path = save_path if save_path is not None else ""
-		print("Logging in EarthData...")
-		self.auth = earthaccess.login(persist=persist_login)
-		self.session = self.auth.get_session()
-	
+		self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+		self.persist_login = persist_login
+		self.product = product
+		self.auth = None
+		self._session = None
+
+	@property
+	def session(self):
+		"""
+		Login Session to EarthData. Logs in only when the first download needs it, after printing the service status
+		of the Data Repository.
+		"""
+		if self._session is None:
+			import earthaccess
+			from utils.service_status import get_service_status
+
+			if self.product is not None:
+				get_service_status(self.product)
+
+			print("Logging in EarthData...")
+			self.auth = earthaccess.login(persist=self.persist_login)
+			self._session = self.auth.get_session()
+		return self._session
+
 	def __download(self, content, save_path, length):
+		"""
+		Writes the downloaded chunks to 'save_path', which can be a filepath or an open binary file-like object.
+		"""
+		if isinstance(save_path, str):
+			try:
+				with open(save_path, "wb") as file:
+					self.__download(content, file, length)
+			except OSError:
+				# Do not leave a partial file behind (e.g. when the disk is full)
+				if os.path.exists(save_path):
+					os.remove(save_path)
+				raise
+			return
 
-		with open(save_path, "wb") as file, tqdm(total=int(length)) as pbar:
+		with tqdm(total=int(length)) as pbar:
 			for chunk in content:
 				# Filter out keep alive chunks
 				if not chunk:
 					continue
 
-				file.write(chunk)
+				save_path.write(chunk)
 				pbar.update(len(chunk))
 
+	def __request(self, url):
+		"""
+		Requests the file from a given URL following the retry policy. Returns None if the request failed.
+		Raises AuthenticationError if the credentials are refused, as every following download would fail too.
+		"""
+		try:
+			http_response = self.retry_policy.request(self.session, url, stream=True)
+		except AuthenticationError:
+			print(f"[Downloader] Invalid credentials for Login session. You may want to delete the credentials on the '.netrc' file and start over.")
+			raise
+		except RetryError as e:
+			print(f"[Downloader] {e}")
+			return None
+
+		if not http_response.ok:
+			print(f"[Downloader] Request for {url} failed with status {http_response.status_code}.")
+
+		return http_response
+
 	def __precheck_file(self, file_path, size):
 		"""
 		Prechecking file mechanism function - if not exists or is corrupted (not equal to the download size), it downloads the file.
@@ -105,12 +162,11 @@ class GEDIDownloader:
 		return True
 
 
-	def download_granule(self, url, chunk_size=128):
+	def __fetch(self, url, chunk_size):
 		"""
-		This function downloads the file from a given URL. Must keep a Login Session alive.
-		Args:
-			url: NASA Repo URL to download the file.
-			chunk_size: Specify chunk size for download in kilobytes. Defaults to 128 KB.
+		Downloads the file from a given URL to 'save_path'.
+		Returns True if the file was downloaded, False if it can not be downloaded (invalid URL, or the request failed
+		after the retries of the retry policy), or None if the download was interrupted or incomplete and can be restarted.
 		"""
 		filename = url.split("/")[-1]
 
@@ -122,26 +178,107 @@ class GEDIDownloader:
 		file_path = os.path.join(self.save_path, filename)
 		chunk_size = chunk_size * 1024 # KB chunk
 
-		http_response = self.session.get(url, stream=True)
+		http_response = self.__request(url)
 
-		# If http response other than OK 200, user needs to check credentials
-		if not http_response.ok:
-			print(f"[Downloader] Invalid credentials for Login session. You may want to delete the credentials on the '.netrc' file and start over.")
+		if http_response is None or not http_response.ok:
 			return False
 
 		response_length = http_response.headers.get('content-length')
 
 		# If file not exists, download
 		if not self.__precheck_file(file_path, int(response_length)):
-			self.__download(http_response.iter_content(chunk_size=chunk_size), file_path, response_length)
+			try:
+				self.__download(http_response.iter_content(chunk_size=chunk_size), file_path, response_length)
+			except OSError as e:
+				# Interrupted stream (requests.RequestException) or failed write to disk
+				print(f"[Downloader] Download of \"{filename}\" interrupted: {e}")
+				return None
 
 		# Check file integrity / if it downloaded correctly
 		if not os.path.getsize(file_path) == int(response_length):
 			# If not downloaded correctly, send message for download retry
-			return False
+			return None
 
 		return True
 
+	def download_granule(self, url, chunk_size=128):
+		"""
+		This function downloads the file from a given URL. Must keep a Login Session alive.
+		Args:
+			url: NASA Repo URL to download the file.
+			chunk_size: Specify chunk size for download in kilobytes. Defaults to 128 KB.
+		"""
+		return self.__fetch(url, chunk_size) is True
+
+	def download_granule_to_memory(self, url, max_size=None, chunk_size=128):
+		"""
+		This function downloads the file from a given URL into memory, without writing it to disk. Must keep a Login Session alive.
+		Args:
+			url: NASA Repo URL to download the file.
+			max_size: Memory budget in bytes. Granules larger than the budget are not downloaded. If None, there is no budget.
+			chunk_size: Specify chunk size for download in kilobytes. Defaults to 128 KB.
+
+		Returns:
+			a binary file-like object (io.BytesIO) with the granule contents, or None if the download failed
+			or the granule does not fit in the memory budget.
+		"""
+		filename = url.split("/")[-1]
+
+		# If even the filename does not have "GEDI" in it, do not download
+		if not "GEDI" in filename:
+			print(f"[Downloader] Invalid URL {url}. Please check URL and download again.")
+			return None
+
+		chunk_size = chunk_size * 1024 # KB chunk
+
+		http_response = self.__request(url)
+
+		if http_response is None or not http_response.ok:
+			return None
+
+		response_length = int(http_response.headers.get('content-length'))
+
+		if max_size is not None and response_length > max_size:
+			print(f"[Downloader] Granule \"{filename}\" ({response_length / 1e6:.1f} MB) exceeds the memory budget ({max_size / 1e6:.1f} MB).")
+			http_response.close()
+			return None
+
+		print(f"[Downloader] Downloading granule \"{filename}\" to memory...")
+		buffer = io.BytesIO()
+		try:
+			self.__download(http_response.iter_content(chunk_size=chunk_size), buffer, response_length)
+		except requests.RequestException as e:
+			print(f"[Downloader] Download of \"{filename}\" interrupted: {e}")
+			return None
+
+		# Check file integrity / if it downloaded correctly
+		if buffer.getbuffer().nbytes != response_length:
+			return None
+
+		buffer.seek(0)
+		return buffer
+
+	def download_granule_with_retries(self, url, retries=None):
+		"""
+		Downloads the file from a given URL, restarting interrupted or incomplete downloads up to 'retries' times with the
+		backoff of the retry policy. If 'retries' is None, uses the number of retries of the retry policy.
+		Failed requests are not restarted, as the retry policy already retried them.
+		Returns True if the file was downloaded.
+		"""
+		retries = retries if retries is not None else self.retry_policy.retries
+
+		for r in range(retries + 1):
+			if r > 0:
+				delay = self.retry_policy.backoff_delay(r - 1)
+				print(f"[Downloader] Incomplete download for link {url}. Retry {r}/{retries} in {delay:.1f} seconds...")
+				time.sleep(delay)
+
+			downloaded = self.__fetch(url, 128)
+			if downloaded is not None:
+				return downloaded
+
+		return False
+
 	def download_files(self, files_url):
 		"""
 		This function downloads a list of files with given URLs. Must keep a Login Session alive.
@@ -152,14 +289,6 @@ class GEDIDownloader:
 		# Start download for every granule
 		for g in files_url:
             # Try Download
-			if not self.download_granule(g[0]):
-				retries = 3
-				print(f"[Downloader] Fail download for link {g}. Retrying...")
-				for r in retries:
-					print(f"Retry {r}")
-					if not self.download_granule(g[0]):
-						retries -= 1
-						continue
-					print(f"[Downloader] Fail download for link {g}. Skipping...")
-					continue
+			if not self.download_granule_with_retries(g[0]):
+				print(f"[Downloader] Fail download for link {g}. Skipping...")
 		return files_url
\ No newline at end of file
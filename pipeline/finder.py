@@ -2,6 +2,8 @@ import os
 import requests as r
 from datetime import datetime
 
+from utils.retry import RetryPolicy, RetryError
+
 # Set up dictionary where key is GEDI shortname + version
 concept_ids = {
     'GEDI01_B.002': 'C2142749196-LPCLOUD', 
@@ -20,6 +22,7 @@ class GEDIFinder:
         date_start: Starting datetime to search for GEDI Data. Must be in format YEAR.month.day (e.g 2020.04.01)
         date_end: End datetime to search for GEDI Data. Must be in format YEAR.month.day (e.g 2020.12.31)
         roi: Region of Interest to search for granules. Coordinates must be in WG84 EPSG:4326 and organized as follows: [UL_Lat, UL_Lon, LR_Lat, LR_Lon]
+        retry_policy: RetryPolicy used for the requests to CMR. If None, uses a RetryPolicy with default settings.
 
     Example usage:
         finder = GEDIFinder(product='GEDI04_A', version='002', date_start='2021.01.01', date_end='2021.12.31', roi=[])
@@ -28,7 +31,7 @@ class GEDIFinder:
         >>> ["URL1", "URL2", "URL3", ...]
     """
 
-    def __init__(self, product='GEDI02_A', version='002', date_start='', date_end='', recurring_months=False, roi=None):
+    def __init__(self, product='GEDI02_A', version='002', date_start='', date_end='', recurring_months=False, roi=None, retry_policy=None):
 
         self.product = product
         self.version = version
@@ -46,6 +49,7 @@ class GEDIFinder:
             self.roi = " ".join(map(str, [ul_lon, lr_lat, lr_lon, ul_lat]))
 
         self.recurring_months = recurring_months
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
 
         if self.recurring_months:
             print("Recurring Months is TRUE. Searching between provided months across all provided years.")
@@ -69,13 +73,16 @@ class GEDIFinder:
 
         try:
             # Send GET request to CMR granule search endpoint w/ product concept ID, bbox & page number, format return as json
-            cmr_response = r.get(f"{cmr}{concept_ids[product]}&bounding_box={bbox}&pageNum={page}").json()['feed']['entry']
+            cmr_response = self.retry_policy.request(r, f"{cmr}{concept_ids[product]}&bounding_box={bbox}&pageNum={page}").json()['feed']['entry']
             # If 2000 features are returned, move to the next page and submit another request, and append to the response
             while len(cmr_response) % 2000 == 0:
                 page += 1
-                cmr_response += r.get(f"{cmr}{concept_ids[product]}&bounding_box={bbox}&pageNum={page}").json()['feed']['entry']
+                cmr_response += self.retry_policy.request(r, f"{cmr}{concept_ids[product]}&bounding_box={bbox}&pageNum={page}").json()['feed']['entry']
             # CMR returns more info than just the Data Pool links, below use list comprehension to return a list of DP links
             return [(c['links'][0]['href'], c['granule_size']) for c in cmr_response if not ".png" in c['links'][0]['href']]
+        except RetryError as e:
+            print(f"[Finder] Request not successful. {e}")
+            exit(0)
         except:
             # If the request did not complete successfully, print out the response from CMR
             print("[Finder] Request not successful.")
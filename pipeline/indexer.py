@@ -0,0 +1,250 @@
+import os
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from utils.utils import get_date_from_gedi_fn
+
+"""
+Spatial footprint index over the subsetted granules saved by the GEDISubsetter.
+"""
+
+class GEDIIndexer:
+    """
+    The GEDIIndexer :class: keeps an index of the subsetted granule files (.gpkg) of an output directory, so footprints
+    can be queried by region and dates reading only the files and rows that can match, instead of every file.
+
+    For each file, the index records its bounding box, date range, beams and number of footprints. Footprints are
+    also binned to a grid of 'tile_size' degrees, and for each tile the index keeps the ranges of rows inside it.
+    The index is saved to an SQLite database in the output directory and updated incrementally as new files are saved.
+
+    Args:
+        directory: Directory with the subsetted granule files (.gpkg).
+        index_path: Filepath to the index database. If None, defaults to '[directory]/gedi_index.sqlite'
+        tile_size: Size in degrees (EPSG:4326) of the grid tiles. Defaults to 0.05 degrees (about 5 km).
+                   Ignored if the index already exists, which keeps its original tile size.
+
+    Example:
+        indexer = GEDIIndexer(directory='some_path')
+        indexer.update()  # Index new and changed files
+        footprints = indexer.query(roi=[ul_lat, ul_lon, lr_lat, lr_lon], date_start='2021.01.01', date_end='2021.12.31')
+    """
+
+    def __init__(self, directory, index_path=None, tile_size=0.05):
+        self.directory = directory
+        self.index_path = index_path if index_path is not None else os.path.join(directory, "gedi_index.sqlite")
+
+        self.db = sqlite3.connect(self.index_path, timeout=60)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime REAL, size INTEGER,
+                min_lon REAL, min_lat REAL, max_lon REAL, max_lat REAL,
+                date_start TEXT, date_end TEXT, beams TEXT, rows INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS tiles (file_id INTEGER, tx INTEGER, ty INTEGER, row_start INTEGER, row_end INTEGER);
+            CREATE INDEX IF NOT EXISTS tiles_xy ON tiles (tx, ty);
+            CREATE INDEX IF NOT EXISTS tiles_file ON tiles (file_id);
+        """)
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('tile_size', ?)", (str(tile_size),))
+        self.db.commit()
+
+        self.tile_size = float(self.db.execute("SELECT value FROM meta WHERE key = 'tile_size'").fetchone()[0])
+
+    def close(self):
+        self.db.close()
+
+    def _tiles_of(self, lons, lats):
+        return np.floor(np.asarray(lons) / self.tile_size).astype(np.int64), np.floor(np.asarray(lats) / self.tile_size).astype(np.int64)
+
+    def add(self, path):
+        """
+        Adds (or replaces) a subsetted granule file to the index.
+        Returns the number of footprints indexed.
+        """
+        import geopandas as gp
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        gdf = gp.read_file(path)
+
+        # Keep the date from the filename if the date column is missing
+        if 'date' in gdf.columns and gdf.shape[0] > 0:
+            dates = sorted(set(gdf['date'].astype(str)))
+            date_start, date_end = dates[0].replace('/', '-'), dates[-1].replace('/', '-')
+        else:
+            date_start = date_end = get_date_from_gedi_fn(path).replace('/', '-')
+
+        beams = ",".join(sorted(set(gdf['BEAM'].astype(str)))) if 'BEAM' in gdf.columns else ""
+        bounds = gdf.total_bounds if gdf.shape[0] > 0 else [None] * 4
+
+        # Group consecutive rows in the same tile into row ranges
+        runs = []
+        if gdf.shape[0] > 0:
+            tx, ty = self._tiles_of(gdf.geometry.x.values, gdf.geometry.y.values)
+            changes = np.flatnonzero((np.diff(tx) != 0) | (np.diff(ty) != 0)) + 1
+            starts = np.concatenate([[0], changes])
+            ends = np.concatenate([changes, [gdf.shape[0]]])
+            runs = [(int(tx[a]), int(ty[a]), int(a), int(b)) for a, b in zip(starts, ends)]
+
+        with self.db:
+            self._remove(path)
+            cursor = self.db.execute(
+                "INSERT INTO files (path, mtime, size, min_lon, min_lat, max_lon, max_lat, date_start, date_end, beams, rows) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, stat.st_mtime, stat.st_size, *[None if b is None else float(b) for b in bounds],
+                 date_start, date_end, beams, int(gdf.shape[0]))
+            )
+            self.db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?, ?)", [(cursor.lastrowid, *r) for r in runs])
+
+        print(f"[Indexer] Indexed {gdf.shape[0]} footprints of {os.path.basename(path)}")
+        return gdf.shape[0]
+
+    def _remove(self, path):
+        row = self.db.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM tiles WHERE file_id = ?", row)
+            self.db.execute("DELETE FROM files WHERE id = ?", row)
+
+    def update(self):
+        """
+        Incrementally updates the index with the subsetted granule files of the directory: indexes new and changed files
+        and removes the files that no longer exist.
+        Returns the number of files (re)indexed.
+        """
+        indexed = {p: (m, s) for p, m, s in self.db.execute("SELECT path, mtime, size FROM files")}
+
+        on_disk = set()
+        updated = 0
+        for f in sorted(os.listdir(self.directory)):
+            if not (f.startswith("GEDI") and f.endswith(".gpkg")):
+                continue
+
+            path = os.path.abspath(os.path.join(self.directory, f))
+            on_disk.add(path)
+            stat = os.stat(path)
+
+            if indexed.get(path) != (stat.st_mtime, stat.st_size):
+                self.add(path)
+                updated += 1
+
+        with self.db:
+            for path in set(indexed) - on_disk:
+                print(f"[Indexer] Removing {os.path.basename(path)} from the index")
+                self._remove(path)
+
+        print(f"[Indexer] Index up to date: {len(on_disk)} files, {updated} (re)indexed")
+        return updated
+
+    def _to_geometry(self, roi):
+        from shapely.geometry import Polygon
+
+        if isinstance(roi, str):
+            roi = [float(c) for c in roi.split(",")]
+
+        if isinstance(roi, (list, tuple)):
+            # Same ROI format as the pipeline: [UL_Lat, UL_Lon, LR_Lat, LR_Lon]
+            return Polygon([(roi[1], roi[0]), (roi[3], roi[0]), (roi[3], roi[2]), (roi[1], roi[2])])
+
+        return roi
+
+    def _date(self, date):
+        return datetime.strptime(date, "%Y.%m.%d").strftime("%Y-%m-%d") if date is not None else None
+
+    def plan(self, roi, date_start=None, date_end=None):
+        """
+        Finds the files and row ranges that can hold footprints inside the ROI and dates, without reading any file.
+
+        Args:
+            roi: Region of interest, either a bounding box [UL_Lat, UL_Lon, LR_Lat, LR_Lon] (or a "ul_lat,ul_lon,lr_lat,lr_lon" string)
+                 or a shapely geometry in EPSG:4326.
+            date_start: Starting date of the query, in format YEAR.month.day (e.g 2020.04.01). If None, no start date.
+            date_end: End date of the query, in format YEAR.month.day (e.g 2020.12.31). If None, no end date.
+
+        Returns:
+            a dict {filepath: [(row_start, row_end), ...]} with the (merged) ranges of rows to read from each file.
+        """
+        from shapely.geometry import box
+
+        geometry = self._to_geometry(roi)
+        min_lon, min_lat, max_lon, max_lat = geometry.bounds
+
+        # Only rows in grid tiles intersecting the ROI geometry can match (every tile in its bounds, for a rectangle)
+        (tx0, tx1), (ty0, ty1) = self._tiles_of([min_lon, max_lon], [min_lat, max_lat])
+        is_rectangle = geometry.equals(box(min_lon, min_lat, max_lon, max_lat))
+        tiles = {}
+
+        sql = ("SELECT f.path, t.tx, t.ty, t.row_start, t.row_end FROM tiles t JOIN files f ON f.id = t.file_id "
+               "WHERE t.tx BETWEEN ? AND ? AND t.ty BETWEEN ? AND ? "
+               "AND f.min_lon <= ? AND f.max_lon >= ? AND f.min_lat <= ? AND f.max_lat >= ?")
+        params = [int(tx0), int(tx1), int(ty0), int(ty1), max_lon, min_lon, max_lat, min_lat]
+        if date_start is not None:
+            sql += " AND f.date_end >= ?"
+            params.append(self._date(date_start))
+        if date_end is not None:
+            sql += " AND f.date_start <= ?"
+            params.append(self._date(date_end))
+
+        ranges = {}
+        for path, x, y, a, b in self.db.execute(sql, params):
+            if not is_rectangle:
+                if (x, y) not in tiles:
+                    tiles[(x, y)] = geometry.intersects(box(x * self.tile_size, y * self.tile_size, (x + 1) * self.tile_size, (y + 1) * self.tile_size))
+                if not tiles[(x, y)]:
+                    continue
+            ranges.setdefault(path, []).append((a, b))
+
+        # Merge overlapping and adjacent row ranges of each file
+        plan = {}
+        for path, file_ranges in ranges.items():
+            merged = []
+            for a, b in sorted(file_ranges):
+                if merged and a <= merged[-1][1]:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+                else:
+                    merged.append((a, b))
+            plan[path] = merged
+
+        return plan
+
+    def query(self, roi, date_start=None, date_end=None):
+        """
+        Queries all the indexed footprints inside the ROI and between the dates provided, reading only the rows
+        of the files that can match (see 'plan').
+
+        Returns:
+            Geopandas dataframe with the matching footprints, with an additional 'source' column holding the granule filename.
+            Returns None if no footprints match.
+        """
+        import pandas as pd
+        import geopandas as gp
+
+        geometry = self._to_geometry(roi)
+        plan = self.plan(geometry, date_start, date_end)
+
+        parts = []
+        for path, ranges in plan.items():
+            for a, b in ranges:
+                part = gp.read_file(path, rows=slice(a, b))
+                part = part[part.geometry.intersects(geometry)]
+
+                if 'date' in part.columns:
+                    dates = part['date'].astype(str).str.replace('/', '-')
+                    keep = np.ones(part.shape[0], dtype=bool)
+                    if date_start is not None:
+                        keep &= dates >= self._date(date_start)
+                    if date_end is not None:
+                        keep &= dates <= self._date(date_end)
+                    part = part[keep]
+
+                if part.shape[0] > 0:
+                    part['source'] = os.path.basename(path)
+                    parts.append(part)
+
+        print(f"[Indexer] Read {sum(len(r) for r in plan.values())} row ranges from {len(plan)} files")
+
+        if not parts:
+            return None
+
+        return gp.GeoDataFrame(pd.concat(parts, ignore_index=True), crs=parts[0].crs)
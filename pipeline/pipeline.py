@@ -1,6 +1,10 @@
-from .finder import *
-from .subsetter import *
-from .downloader import *
+import os
+import hashlib
+
+from .finder import GEDIFinder
+from .workqueue import GEDIWorkQueue
+from .admission import GEDIDiskBudget
+from utils.retry import RetryPolicy, AuthenticationError
 
 """
 Script that controls the entire GEDI Finder - Downloader - Subsetter pipeline.
@@ -13,13 +17,27 @@ class GEDIPipeline:
         out
     """
 
-    def __init__(self, out_directory, product, version, date_start, date_end, recurring_months, roi, sds, beams, persist_login=False, keep_original_file=False):
+    def __init__(self, out_directory, product, version, date_start, date_end, recurring_months, roi, sds, beams, persist_login=False, keep_original_file=False,
+                 in_memory=False, memory_budget=2048, max_retries=5, rate_limit=None, build_index=False,
+                 aggregate=None, aggregate_resolution=0.01, aggregate_output=None,
+                 disk_budget=None, min_free_space=1024, admission_timeout=3600):
 
         self.product = product
         self.version = version
         self.date_start, self.date_end = date_start, date_end
         self.recurring_months = recurring_months
         self.keep_original_file = keep_original_file
+        self.in_memory = in_memory
+        self.memory_budget = float(memory_budget) * 1e6  # MB to bytes
+        self.build_index = build_index
+        self._defer_index = False
+        self.aggregate = aggregate
+        self.aggregate_resolution = aggregate_resolution
+        self.aggregate_output = aggregate_output if aggregate_output is not None else os.path.join(out_directory, "gedi_aggregate.npz")
+
+        if self.aggregate:
+            from .aggregator import check_output
+            check_output(self.aggregate_output)
 
         if isinstance(roi, list):
             self.roi = [float(c) for c in roi]
@@ -32,61 +50,509 @@ class GEDIPipeline:
         self.beams = beams
         self.persist_login = persist_login
 
+        # Retry policy shared by the Finder and Downloader requests. When requests to a host keep failing,
+        # the service status notices are checked before trying the host again
+        self.retry_policy = RetryPolicy(retries=max_retries, rate=rate_limit, status_check=self._service_outage)
+
         self.finder = GEDIFinder(
             product=self.product,
             version=self.version,
             date_start=self.date_start,
             date_end=self.date_end,
             recurring_months=self.recurring_months,
-            roi=self.roi
-        )
-        
-        self.downloader = GEDIDownloader(
-            persist_login=self.persist_login,
-            save_path=self.out_directory
-        )
-
-        self.subsetter = GEDISubsetter(
             roi=self.roi,
-            product=self.product,
-            out_dir=self.out_directory,
-            sds=self.sds,
-            beams=self.beams
+            retry_policy=self.retry_policy
         )
+        
+        # Downloader and Subsetter (and their dependencies) are only loaded when first needed
+        self._downloader = None
+        self._subsetter = None
+        self._indexer = None
+        self._aggregator = None
 
         # Make dir if not exists
         if not os.path.exists(out_directory):
             os.mkdir(out_directory)
 
+        # Admit downloads against the disk budget (MB), if provided
+        self.admission_timeout = admission_timeout
+        self.disk = None
+        if disk_budget is not None:
+            self.disk = GEDIDiskBudget(
+                directory=self.out_directory,
+                budget=float(disk_budget) * 1e6,
+                min_free=float(min_free_space) * 1e6
+            )
 
-    def run_pipeline(self):
 
-        all_granules = self.finder.find(output_filepath=self.out_directory, save_file=True)
+    @property
+    def downloader(self):
+        if self._downloader is None:
+            from .downloader import GEDIDownloader
+
+            self._downloader = GEDIDownloader(
+                persist_login=self.persist_login,
+                save_path=self.out_directory,
+                retry_policy=self.retry_policy,
+                product=self.product
+            )
+        return self._downloader
+
+
+    def _service_outage(self):
+        """
+        Checks the service status notices of the Data Repository for an announced outage.
+        """
+        from utils.service_status import get_service_status, has_outage_notice
+
+        try:
+            return has_outage_notice(get_service_status(self.product, quiet=True))
+        except Exception:
+            return False
+
+
+    @property
+    def subsetter(self):
+        if self._subsetter is None:
+            from .subsetter import GEDISubsetter
+
+            self._subsetter = GEDISubsetter(
+                roi=self.roi,
+                product=self.product,
+                out_dir=self.out_directory,
+                sds=self.sds,
+                beams=self.beams
+            )
+        return self._subsetter
+
+
+    @property
+    def indexer(self):
+        if self._indexer is None:
+            from .indexer import GEDIIndexer
+
+            self._indexer = GEDIIndexer(directory=self.out_directory)
+        return self._indexer
+
+
+    @property
+    def aggregator(self):
+        if self._aggregator is None:
+            from .aggregator import GEDIAggregator
+
+            self._aggregator = GEDIAggregator(
+                roi=self.roi,
+                variables=self.aggregate,
+                resolution=self.aggregate_resolution
+            )
+        return self._aggregator
+
+
+    def _index_subset(self, granule_path):
+        """
+        Adds the subsetted file of a granule to the footprint index, if it was saved.
+        Workers defer indexing until the queue is drained, see run_worker.
+        """
+        out_path = granule_path.replace(".h5", ".gpkg")
+        if self.build_index and not self._defer_index and os.path.exists(out_path):
+            self.indexer.add(out_path)
+
+
+    def _aggregate_subset(self, subset_df):
+        """
+        Adds the footprints of a subsetted granule to the grid statistics, if aggregating.
+        """
+        if self.aggregate and subset_df is not None:
+            self.aggregator.update(subset_df)
+
+
+    def plan(self):
+        """
+        Lists the granules found for the query and what is left to process, without logging in to EarthData,
+        downloading or subsetting any granule.
+
+        Returns:
+            a dict with the granules to process ('pending'), the granules already subsetted ('subsetted'), the granules
+            already downloaded but not subsetted ('downloaded') and the estimated download size in bytes ('download_bytes')
+        """
+        all_granules = self.finder.find(output_filepath=self.out_directory, save_file=False)
+
+        plan = {'pending': [], 'downloaded': [], 'subsetted': [], 'download_bytes': 0}
 
-        # Start download for every granule
         for g in all_granules:
+            granule_path = os.path.join(self.out_directory, g[0].split("/")[-1])
+
+            if os.path.exists(granule_path.replace(".h5", ".gpkg")):
+                plan['subsetted'].append(g)
+            elif os.path.exists(granule_path):
+                plan['downloaded'].append(g)
+            else:
+                plan['pending'].append(g)
+                plan['download_bytes'] += int(float(g[1]) * 1e6)  # CMR granule size is in MB
+
+        for g in plan['pending']:
+            print(f"[Plan] To download and subset: {g[0]} ({float(g[1]):.1f} MB)")
+        for g in plan['downloaded']:
+            print(f"[Plan] To subset (already downloaded): {g[0]}")
+
+        print(f"[Plan] {len(all_granules)} granules found: {len(plan['subsetted'])} already subsetted, "
+              f"{len(plan['downloaded'])} downloaded, {len(plan['pending'])} to download.")
+        print(f"[Plan] Estimated download size : {plan['download_bytes'] / 1e9:.2f} GB")
+
+        return plan
 
-            if os.path.exists(os.path.join(self.out_directory, g[0].split("/")[-1].replace(".h5", ".gpkg"))):
-                print(f"Skipping granule from link {g} as it is already subsetted.")
-                continue
 
+    def _download_and_subset(self, g, save=True):
+        """
+        Downloads and subsets a single granule (url, size) found by the GEDIFinder.
+        Returns a tuple (ok, subset_df), where 'ok' is False if the granule could not be downloaded
+        and 'subset_df' is the dataframe returned by the GEDISubsetter.
+        """
+        granule_path = os.path.join(self.out_directory, g[0].split("/")[-1])
+
+        # Subset straight from memory when the granule fits in the memory budget, else fall back to disk
+        if self._fits_in_memory(g):
+            buffer = self.downloader.download_granule_to_memory(g[0], max_size=self.memory_budget)
+
+            if buffer is not None:
+                subset_df = self.subsetter.subset(granule_path, file_obj=buffer, save=save)
+                buffer.close()
+                self._index_subset(granule_path)
+                self._aggregate_subset(subset_df)
+                return True, subset_df
+
+            print(f"[Pipeline] Could not download granule from link {g} to memory. Downloading to disk...")
+
+        # Reserve disk space for the granule, pausing until it is available
+        granule = g[0].split("/")[-1]
+        if self.disk is not None and not self.disk.reserve(granule, float(g[1]) * 1e6, timeout=self.admission_timeout):
+            print(f"[Pipeline] No disk space to download granule from link {g}. Skipping...")
+            return False, None
+
+        try:
             # Try Download
-            if not self.downloader.download_granule(g[0]):
-                retries = 3
-                print(f"[Downloader] Fail download for link {g}. Retrying...")
-                for r in retries:
-                    print(f"Retry {r}")
-                    if not self.downloader.download_granule(g[0]):
-                        retries -= 1
-                        continue
+            if not self.downloader.download_granule_with_retries(g[0]):
                 print(f"[Downloader] Fail download for link {g}. Skipping...")
-                continue
+                return False, None
 
             # Subset
-            self.subsetter.subset(os.path.join(self.out_directory, g[0].split("/")[-1]))
+            subset_df = self.subsetter.subset(granule_path, save=save)
+            self._index_subset(granule_path)
+            self._aggregate_subset(subset_df)
 
             # Delete original file and keep subset to ROI granule to save space
             if not self.keep_original_file:
-                os.remove(os.path.join(self.out_directory, g[0].split("/")[-1]))
+                os.remove(granule_path)
+        finally:
+            if self.disk is not None:
+                self.disk.release(granule)
+
+        return True, subset_df
+
+
+    def _fits_in_memory(self, g):
+        """
+        Checks if a granule is downloaded and subsetted in memory, instead of on disk.
+        """
+        return self.in_memory and not self.keep_original_file and float(g[1]) * 1e6 <= self.memory_budget
+
+
+    def _admission_order(self, granules):
+        """
+        Orders the granules so the pipeline keeps moving under the disk budget: granules that can be downloaded now
+        go first, the ones that do not fit are deferred (smallest first) until disk space is freed.
+        """
+        if self.disk is None:
+            yield from granules
+            return
+
+        pending = list(granules)
+        while pending:
+            deferred = []
+            for g in pending:
+                granule_path = os.path.join(self.out_directory, g[0].split("/")[-1])
+                size = float(g[1]) * 1e6
+
+                # Granules already subsetted or downloaded, or subsetted in memory, do not need disk space
+                if (self._fits_in_memory(g) or os.path.exists(granule_path) or os.path.exists(granule_path.replace(".h5", ".gpkg"))
+                        or self.disk.fits(size)):
+                    yield g
+                elif not self.disk.can_ever_fit(size):
+                    print(f"[Pipeline] Granule from link {g} is larger than the disk budget. Skipping...")
+                else:
+                    deferred.append(g)
+
+            deferred.sort(key=lambda g: float(g[1]))
+
+            # Nothing could be admitted in this pass, pause until the smallest deferred granule fits
+            if deferred and len(deferred) == len(pending):
+                # No download in progress will free space, waiting only helps if the granule files are removed by hand
+                if self.disk.is_exhausted(float(deferred[0][1]) * 1e6):
+                    print(f"[Pipeline] Granule files in \"{self.out_directory}\" exhaust the disk budget. Skipping {len(deferred)} granules...")
+                    return
+
+                print(f"[Pipeline] Disk budget exhausted. Pausing {len(deferred)} downloads until space is available...")
+                if not self.disk.wait_for(float(deferred[0][1]) * 1e6, timeout=self.admission_timeout):
+                    print(f"[Pipeline] No disk space available after {self.admission_timeout} seconds. Skipping {len(deferred)} granules...")
+                    return
+
+            pending = deferred
+
+
+    def _process_granule(self, g):
+        """
+        Downloads and subsets a single granule (url, size) found by the GEDIFinder, unless it is already subsetted.
+        Returns False if the granule could not be downloaded, True otherwise.
+        """
+        out_path = os.path.join(self.out_directory, g[0].split("/")[-1].replace(".h5", ".gpkg"))
+
+        if os.path.exists(out_path):
+            print(f"Skipping granule from link {g} as it is already subsetted.")
+
+            # Already subsetted footprints still count for the grid statistics
+            if self.aggregate:
+                import geopandas as gp
+                self._aggregate_subset(gp.read_file(out_path))
+            return True
+
+        ok, _ = self._download_and_subset(g)
+        return ok
+
+
+    def run_pipeline(self):
+
+        all_granules = self.finder.find(output_filepath=self.out_directory, save_file=True)
+
+        # Start download for every granule, in the order admitted by the disk budget
+        for g in self._admission_order(all_granules):
+            self._process_granule(g)
+
+        # Index any subsetted file saved by previous runs
+        if self.build_index:
+            self.indexer.update()
+
+        if self.aggregate:
+            self.aggregator.save(self.aggregate_output)
+
+        return all_granules
+
+
+    def iter_subsets(self, save=False, output="geodataframe", batch_size=65536):
+        """
+        Streams the subset of every granule found for the query as soon as it is ready, one granule at a time,
+        so the results can be consumed in-process while the remaining granules are still being processed.
+        Only one granule is kept in memory at a time, and stopping the iteration early stops the pipeline.
+
+        Granules already subsetted to the output directory are read from their GPKG file instead of downloaded again.
+        If aggregating, the footprints of every granule are added to the grid statistics, saved when the iteration ends.
+
+        Args:
+            save: If True, also exports each subset to a GPKG file in the output directory. Defaults to False.
+            output: Format of the yielded data. Select from "geodataframe" (GeoPandas dataframe) or "arrow"
+                    (list of pyarrow.RecordBatch, with the geometry encoded as WKB). Defaults to "geodataframe".
+            batch_size: Maximum number of footprints per record batch, if output is "arrow".
+
+        Yields:
+            a dict for each granule with intersecting footprints, with keys:
+                'granule': granule filename, 'url': download link, 'date': acquisition date (YYYY/mm/dd),
+                'product': GEDI product, 'rows': number of footprints, 'path': filepath of the GPKG file or None if not saved,
+                'cached': True if read from an existing GPKG file, 'data': the subset in the format selected in 'output'
+
+        Example:
+            for result in pipeline.iter_subsets():
+                result['data'].plot()
+                if enough: break
+        """
+        if output not in ["geodataframe", "arrow"]:
+            raise ValueError(f"Invalid output format \"{output}\". Select from \"geodataframe\" or \"arrow\".")
+
+        if output == "arrow":
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError("[Pipeline] Output format \"arrow\" requires pyarrow. Install it, or use \"geodataframe\".") from None
+
+        # Arguments are checked when called, the granules are only processed while iterating
+        return self._iter_subsets(save, output, batch_size)
+
+
+    def _iter_subsets(self, save, output, batch_size):
+        from utils.utils import get_date_from_gedi_fn
+
+        all_granules = self.finder.find(output_filepath=self.out_directory, save_file=False)
+
+        try:
+            for g in all_granules:
+                granule = g[0].split("/")[-1]
+                out_path = os.path.join(self.out_directory, granule.replace(".h5", ".gpkg"))
+                cached = os.path.exists(out_path)
+
+                if cached:
+                    import geopandas as gp
+
+                    print(f"[Pipeline] Reading granule {granule} from its already subsetted file.")
+                    subset_df = gp.read_file(out_path)
+
+                    # Already subsetted footprints still count for the grid statistics
+                    self._aggregate_subset(subset_df)
+                else:
+                    ok, subset_df = self._download_and_subset(g, save=save)
+                    if not ok:
+                        continue
+
+                if subset_df is None or subset_df.shape[0] == 0:
+                    continue
+
+                result = {
+                    'granule': granule,
+                    'url': g[0],
+                    'date': get_date_from_gedi_fn(granule),
+                    'product': self.product,
+                    'rows': subset_df.shape[0],
+                    'path': out_path if (cached or save) else None,
+                    'cached': cached,
+                    'data': subset_df if output == "geodataframe" else self._to_record_batches(subset_df, batch_size)
+                }
+                del subset_df
+
+                yield result
+                del result
+        finally:
+            # Save the statistics of the granules streamed so far, also when the iteration is stopped early
+            if self.aggregate:
+                self.aggregator.save(self.aggregate_output)
+
+
+    def _to_record_batches(self, subset_df, batch_size):
+        """
+        Converts a subset GeoPandas dataframe to a list of Arrow record batches, with the geometry encoded as WKB.
+        """
+        import pandas as pd
+        import pyarrow as pa
+
+        table = pd.DataFrame(subset_df.drop(columns=subset_df.geometry.name))
+        table['geometry'] = subset_df.geometry.to_wkb().values
+
+        return pa.Table.from_pandas(table, preserve_index=False).to_batches(max_chunksize=batch_size)
+
+
+    def _query_key(self):
+        """
+        Returns a key identifying the granule query of the pipeline.
+        """
+        return f"{self.product}.{self.version}_{self.date_start}-{self.date_end}_{','.join(map(str, self.roi))}_{self.recurring_months}"
+
+
+    def _worker_grids_dir(self, queue):
+        """
+        Returns the directory of the worker grids for the query and grid of the pipeline, so grids of other queries
+        that topped up the same queue (with another ROI or resolution) are never merged together.
+        """
+        grid_key = f"{self._query_key()}_{self.aggregate}_{self.aggregate_resolution}"
+        grids_dir = os.path.join(queue.queue_dir, "aggregate", hashlib.sha1(grid_key.encode()).hexdigest()[:16])
+        os.makedirs(grids_dir, exist_ok=True)
+        return grids_dir
+
+
+    def _save_worker_grid(self, queue, grids_dir):
+        """
+        Saves the grid statistics of this worker's granules to the queue directory. Written to a temporary file first,
+        so a merging worker never reads a partially written grid.
+        """
+        tmp_path = os.path.join(grids_dir, f".{queue.worker_id}.tmp.npz")
+        self.aggregator.save(tmp_path)
+        os.replace(tmp_path, os.path.join(grids_dir, f"{queue.worker_id}.npz"))
+
+
+    def _merge_worker_grids(self, queue, grids_dir):
+        """
+        Merges the grids of every worker into 'aggregate_output'. Every worker merges after saving its own grid,
+        so the last worker to finish writes the statistics of all workers.
+        """
+        from .aggregator import GEDIAggregator
+
+        with queue.locked("aggregate"):
+            grids = sorted(f for f in os.listdir(grids_dir) if f.endswith(".npz") and not f.startswith("."))
+            print(f"[Pipeline] Queue drained. Merging the grid statistics of {len(grids)} workers...")
+
+            merged = GEDIAggregator.load(os.path.join(grids_dir, grids[0]))
+            for f in grids[1:]:
+                merged.merge(GEDIAggregator.load(os.path.join(grids_dir, f)))
+            merged.save(self.aggregate_output)
+
+
+    def run_worker(self, queue_dir=None, worker_id=None, lease_seconds=600):
+        """
+        Runs the pipeline as one of many cooperative workers sharing a GEDIWorkQueue over the granule list.
+        The first worker to start runs the GEDIFinder and populates the queue. Every worker then claims granules,
+        downloads and subsets them independently, and returns when the queue is empty.
+        If aggregating, the grid statistics of all workers are merged into 'aggregate_output' when the queue is drained.
+        If building the index, the subsetted files are indexed when the queue is drained, one worker at a time, so
+        workers on several hosts never write to the index database (on the shared directory) concurrently.
+
+        Args:
+            queue_dir: Directory of the shared queue. Must be reachable by all workers. Defaults to '[out_directory]/.queue'
+            worker_id: Unique name of this worker. If None, uses the hostname and process id.
+            lease_seconds: Seconds a claimed granule stays leased to this worker without a heartbeat.
+
+        Returns:
+            a list with the granule links processed by this worker
+        """
+        queue_dir = queue_dir if queue_dir is not None else os.path.join(self.out_directory, ".queue")
+        queue = GEDIWorkQueue(queue_dir=queue_dir, worker_id=worker_id, lease_seconds=lease_seconds)
+        self._defer_index = True
+
+        # A later run over the same queue with a different query tops it up with the new granules
+        queue.populate(lambda: self.finder.find(output_filepath=self.out_directory, save_file=True), key=self._query_key())
+
+        # Each worker keeps the grid statistics of the granules it completed in the queue directory.
+        # A worker restarted with the same id continues from its saved grid
+        if self.aggregate:
+            from .aggregator import GEDIAggregator
+
+            grids_dir = self._worker_grids_dir(queue)
+            grid_path = os.path.join(grids_dir, f"{queue.worker_id}.npz")
+            if os.path.exists(grid_path):
+                self._aggregator = GEDIAggregator.load(grid_path)
+
+        processed = []
+        try:
+            while (task := queue.claim()) is not None:
+                print(f"[Pipeline] Worker {queue.worker_id} claimed granule {task['url']} (attempt {task['attempts']})")
+                g = (task['url'], task['size'])
+
+                try:
+                    done = self._process_granule(g)
+                except AuthenticationError:
+                    queue.release(task)
+                    raise
+                except Exception as e:
+                    print(f"[Pipeline] Worker {queue.worker_id} failed processing granule {task['url']}: {e}")
+                    done = False
+
+                if done:
+                    # Save the grid before completing, so the granules of a worker that dies are never missing from it
+                    if self.aggregate:
+                        self._save_worker_grid(queue, grids_dir)
+                    queue.complete(task)
+                    processed.append(g)
+                else:
+                    queue.release(task)
+        finally:
+            queue.close()
+
+        if self.aggregate:
+            self._save_worker_grid(queue, grids_dir)
+
+        # Once the queue is drained, the finishing workers write the outputs shared by all workers
+        status = queue.status()
+        if status['pending'] == 0 and status['claimed'] == 0:
+            if self.aggregate:
+                self._merge_worker_grids(queue, grids_dir)
+
+            if self.build_index:
+                with queue.locked("index"):
+                    self.indexer.update()
 
-        return all_granules
\ No newline at end of file
+        print(f"[Pipeline] Worker {queue.worker_id} finished. Queue status: {queue.status()}")
+        return processed
@@ -114,8 +114,10 @@ class GEDISubsetter:
         This function selects all the footprints inside the ROI with the select beams
         Reference:  https://github.com/nasa/GEDI-Data-Resources/blob/main/python/scripts/GEDI_Subsetter/GEDI_Subsetter.py
         """
+        min_lon, min_lat, max_lon, max_lat = self.ROI.envelope.bounds
+        beam_dfs = [gedi_df] if gedi_df.shape[0] > 0 else []
 
-        # Loop through each beam and create a geodataframe with lat/lon for each shot, then clip to ROI
+        # Loop through each beam and keep the lat/lon of each shot within the ROI, keeping the HDF5 dtypes
         for b in beams:
             beams_sds = [s for s in gedi_sds if b in s]
             
@@ -124,27 +126,30 @@ class GEDISubsetter:
             lon = [l for l in beams_sds if self.sds_subset[1] in l][0]
             shot = f'{b}/shot_number'          
             
-            # Open latitude, longitude, and shot number SDS
-            shots = gedi_file[shot][()]
+            # Open latitude and longitude SDS
             lats = gedi_file[lat][()]
             lons = gedi_file[lon][()]
-            
+
+            # Clip to only include points within the user-defined bounding box (before building any geometry)
+            index = np.flatnonzero((lons > min_lon) & (lons < max_lon) & (lats > min_lat) & (lats < max_lat))
+            if len(index) == 0:
+                continue
+
+            # Read shot numbers only over the range of clipped shots
+            shots = gedi_file[shot][index[0]:index[-1] + 1][index - index[0]]
+
             # Append BEAM, shot number, latitude, longitude and an index to the GEDI dataframe
-            geoDF = pd.DataFrame({'BEAM': len(shots) * [b], shot.split('/', 1)[-1].replace('/', '_'): shots,
-                                'Latitude':lats, 'Longitude':lons, 'index': np.arange(0, len(shots), 1)})
+            beam_dfs.append(pd.DataFrame({'BEAM': pd.Categorical.from_codes(np.full(len(index), beams.index(b), dtype=np.int8), categories=beams),
+                                          shot.split('/', 1)[-1].replace('/', '_'): shots,
+                                          'Latitude': lats[index], 'Longitude': lons[index], 'index': index}, index=index))
+            del lats, lons
 
-            # Convert lat/lon coordinates to shapely points and append to geodataframe
-            geoDF = gp.GeoDataFrame(geoDF, geometry=gp.points_from_xy(geoDF.Longitude, geoDF.Latitude))
+        if beam_dfs:
+            gedi_df = pd.concat(beam_dfs)
 
-            # Clip to only include points within the user-defined bounding box
-            geoDF = geoDF[geoDF['geometry'].within(self.ROI.envelope)]
-            gedi_df = pd.concat([gedi_df, geoDF])
-            del geoDF
-    
-        # Convert to geodataframe and add crs
-        gedi_df = gp.GeoDataFrame(gedi_df)
-        gedi_df.crs = 'EPSG:4326'
-        del lats, lons, shots
+        # Convert lat/lon coordinates to shapely points and convert to geodataframe with crs
+        if gedi_df.shape[0] > 0:
+            gedi_df = gp.GeoDataFrame(gedi_df, geometry=gp.points_from_xy(gedi_df.Longitude, gedi_df.Latitude), crs='EPSG:4326')
 
         return gedi_df
 
@@ -155,48 +160,47 @@ class GEDISubsetter:
         Reference:  https://github.com/nasa/GEDI-Data-Resources/blob/main/python/scripts/GEDI_Subsetter/GEDI_Subsetter.py
         """
 
-        beams_df = pd.DataFrame()  # Create dataframe to store SDS
-        j = 0
+        beam_dfs = []  # Store the SDS dataframe of each beam, to concatenate once
         
         # Loop through each beam and extract subset of defined SDS
         for b in beams:
-            beam_df = pd.DataFrame()
             beam_sds = [s for s in gedi_sds if b in s and not any(s.endswith(d) for d in self.sds_subset[0:3])]
             shot = f'{b}/shot_number'
             
-            try:
-                # set up indexes in order to retrieve SDS data only within the clipped subset from above
-                mindex = min(gedi_df[gedi_df['BEAM'] == b]['index'])
-                maxdex = max(gedi_df[gedi_df['BEAM'] == b]['index']) + 1
-                shots = gedi_file[shot][mindex:maxdex]
-            except ValueError:
+            # set up indexes in order to retrieve SDS data only within the clipped subset from above
+            beam_index = gedi_df['index'].values[(gedi_df['BEAM'] == b).values]
+            if len(beam_index) == 0:
                 print(f"[Subsetter] No intersecting shots found for {b} for {gedi_file}.")
                 continue
 
+            mindex, maxdex = int(beam_index.min()), int(beam_index.max()) + 1
+            n_shots = maxdex - mindex
+
+            # Columns of the beam, with the dtype of each dataset and a known number of rows
+            columns = {}
+
             # Loop through and extract each SDS subset and add to DF
             for s in beam_sds:
-                j += 1
                 s_name = s.split('/', 1)[-1].replace('/', '_')
+                ds = gedi_file[s]
 
                 # Datasets with consistent structure as shots
-                if gedi_file[s].shape == gedi_file[shot].shape:
-                    beam_df[s_name] = gedi_file[s][mindex:maxdex]  # Subset by index
+                if ds.shape == gedi_file[shot].shape:
+                    columns[s_name] = ds[mindex:maxdex]  # Subset by index
                 
                 # Datasets with a length of one 
-                elif len(gedi_file[s][()]) == 1:
-                    beam_df[s_name] = [gedi_file[s][()][0]] * len(shots) # create array of same single value
+                elif ds.shape[0] == 1:
+                    columns[s_name] = np.full(n_shots, ds[0], dtype=ds.dtype) # create array of same single value
                 
                 # Multidimensional datasets
-                elif len(gedi_file[s].shape) == 2 and 'surface_type' not in s: 
-                    all_data = gedi_file[s][()][mindex:maxdex]
+                elif len(ds.shape) == 2 and 'surface_type' not in s: 
+                    all_data = ds[mindex:maxdex]
                     
                     # For each additional dimension, create a new output column to store those data
-                    for i in range(gedi_file[s].shape[1]):
-                        step = []
-                        for a in all_data:
-                            step.append(a[i])
+                    for i in range(ds.shape[1]):
+                        columns[f"{s_name}_{i}"] = np.ascontiguousarray(all_data[:, i])
 
-                        beam_df[f"{s_name}_{i}"] = step
+                    del all_data
                 
                 # Waveforms
                 elif s.endswith('waveform') or s.endswith('pgap_theta_z'):
@@ -213,41 +217,49 @@ class GEDISubsetter:
                         start = gedi_file[f'{b}/rx_sample_start_index'][mindex:maxdex]
                         count = gedi_file[f'{b}/rx_sample_count'][mindex:maxdex]
 
-                    wave = gedi_file[s][()]
+                    # Read only the samples of the subset waveforms
+                    first = int(start.min() - 1)
+                    wave = ds[first:int((start + count).max() - 1)]
                     
                     # In the dataframe, each waveform will be stored as a list of values
                     for k in range(len(start)):
-                        single_WF = wave[int(start[k] - 1): int(start[k] - 1 + count[k])]
+                        single_WF = wave[int(start[k] - 1) - first: int(start[k] - 1 + count[k]) - first]
                         waveform.append(','.join([str(q) for q in single_WF]))
 
-                    beam_df[s_name] = waveform
+                    columns[s_name] = waveform
+                    del wave
                 
                 # Surface type 
                 elif s.endswith('surface_type'):
                     surfaces = ['land', 'ocean', 'sea_ice', 'land_ice', 'inland_water']
-                    all_data = gedi_file[s][()]
+                    all_data = ds[:, mindex:maxdex]
 
-                    for i in range(gedi_file[s].shape[0]):
-                        beam_df[f'{surfaces[i]}'] = all_data[i][mindex:maxdex]
+                    for i in range(ds.shape[0]):
+                        columns[f'{surfaces[i]}'] = all_data[i]
 
                     del all_data
 
                 else:
                     print(f"[Subsetter] SDS: {s} not found")
             
-            beams_df = pd.concat([beams_df, beam_df])
+            beam_dfs.append(pd.DataFrame(columns))
+            del columns
 
-        del beam_df, beam_sds, beams, gedi_file, gedi_sds, shots
+        beams_df = pd.concat(beam_dfs) if beam_dfs else pd.DataFrame()
+        del beam_dfs, beams, gedi_file, gedi_sds
         
         return beams_df
 
 
-    def subset(self, granule):
+    def subset(self, granule, file_obj=None, save=True):
         """
         Subsets an entire downloaded granule file and exports to GPKG (or other format) with the same filename
 
         Args:
             granule: filepath to granule file, already downloaded.
+            file_obj: Optional binary file-like object (e.g. io.BytesIO) holding the granule contents, already downloaded to memory.
+                      If provided, the granule is read from it and 'granule' is only used to name the output file.
+            save: If False, only returns the subsetted dataframe, without exporting it to a file. Defaults to True.
 
         Returns:
             Geopandas dataframe with all the intersecting footprints at ROI and select SDS variables
@@ -258,12 +270,12 @@ class GEDISubsetter:
 
         # Open granule file
         print(f"[Subsetter] Processing file: {granule}")
-        h5_granule = h5py.File(granule, 'r')      # Open file
+        h5_granule = h5py.File(granule if file_obj is None else file_obj, 'r')      # Open file
         granule_name = granule.split('.h5')[0]  # Keep original filename
 
         # Check if already subsetted file exists
         ## TODO: not sure if good idea to keep this or not.
-        if os.path.exists(os.path.join(self.out_dir, granule.split("/")[-1].replace(".h5", ".gpkg"))):
+        if save and os.path.exists(os.path.join(self.out_dir, granule.split("/")[-1].replace(".h5", ".gpkg"))):
             print(f"[Subsetter] File: {granule} already subsetted. Skipping...")
             return
 
@@ -312,10 +324,12 @@ class GEDISubsetter:
             out_df = out_df[out_df['geometry'].is_valid]
             out_df = out_df[~out_df['geometry'].is_empty]
 
-            # Write date column to subsetted file
-            out_df['date'] = get_date_from_gedi_fn(granule_name)
+            # Write date column to subsetted file, dictionary encoded as every footprint shares the date
+            out_df['date'] = pd.Categorical.from_codes(np.zeros(out_df.shape[0], dtype=np.int8), categories=[get_date_from_gedi_fn(granule_name)])
         
-        ## TODO: Implement the saving to file module as optional
+        if not save:
+            return out_df
+
         try:    
             # Export final geodataframe as Geojson
             print(f"[Subsetter] {granule_name}.gpkg")
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import socket
+import threading
+from contextlib import contextmanager
+
+from utils.locks import acquire_lock, release_lock
+
+"""
+Shared work queue over the granule list, used to cooperatively run the pipeline with several workers.
+"""
+
+class GEDIWorkQueue:
+    """
+    The GEDIWorkQueue :class: implements a filesystem-backed work queue of granules, allowing many
+    GEDIPipeline workers (processes on the same machine or on several machines sharing a filesystem)
+    to claim granules, keep them leased while processing and release them when done.
+
+    Every granule is a small JSON task file that moves between the queue state directories with atomic
+    renames, so only one worker can hold a given granule at a time:
+        pending/ -> claimed/ -> done/ (or failed/ after 'max_attempts' claims)
+
+    A claimed granule is leased for 'lease_seconds'. The lease is kept alive by a heartbeat thread that
+    touches the task file. Any worker finding a task whose heartbeat is older than the lease returns it
+    to pending/, so granules held by dead workers are reclaimed.
+
+    Args:
+        queue_dir: Directory shared by all workers to store the queue state.
+        worker_id: Unique name of this worker. If None, builds one from the hostname and process id.
+        lease_seconds: Seconds a claim stays valid without a heartbeat. Defaults to 600 seconds.
+        heartbeat_seconds: Interval between heartbeats. If None, defaults to a third of the lease.
+        max_attempts: Number of times a granule can be claimed before it is moved to failed/.
+
+    Example:
+        queue = GEDIWorkQueue(queue_dir='some_path/.queue')
+        queue.populate(granules, key='GEDI02_A.002 2021.01.01-2021.12.31')  # [(url, size), ...] from GEDIFinder.find
+        while (task := queue.claim()) is not None:
+            ...  # process task['url']
+            queue.complete(task)
+    """
+
+    STATES = ["pending", "claimed", "done", "failed"]
+
+    def __init__(self, queue_dir, worker_id=None, lease_seconds=600, heartbeat_seconds=None, max_attempts=3):
+        self.queue_dir = queue_dir
+        self.worker_id = worker_id if worker_id is not None else f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_seconds = float(lease_seconds)
+        self.heartbeat_seconds = float(heartbeat_seconds) if heartbeat_seconds is not None else self.lease_seconds / 3
+        self.max_attempts = max_attempts
+
+        self._held = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+        for state in self.STATES:
+            os.makedirs(os.path.join(self.queue_dir, state), exist_ok=True)
+
+    def _path(self, state, name):
+        return os.path.join(self.queue_dir, state, name)
+
+    def _list(self, state):
+        return sorted(f for f in os.listdir(os.path.join(self.queue_dir, state)) if f.endswith(".json"))
+
+    def _read(self, path):
+        with open(path, "r") as tf:
+            return json.load(tf)
+
+    def _write(self, path, task):
+        tmp_path = f"{path}.{self.worker_id}.tmp"
+        with open(tmp_path, "w") as tf:
+            json.dump(task, tf)
+        os.replace(tmp_path, path)
+
+    def _move(self, src_state, dst_state, name):
+        """
+        Atomically moves a task file between states. Returns False if another worker moved it first.
+        """
+        try:
+            os.rename(self._path(src_state, name), self._path(dst_state, name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _populated_keys(self):
+        try:
+            with open(os.path.join(self.queue_dir, "populated"), "r") as mf:
+                return set(line.strip() for line in mf if line.strip())
+        except FileNotFoundError:
+            return set()
+
+    def is_populated(self, key=None):
+        """
+        Checks if the queue was populated, for the granule query 'key' if provided.
+        """
+        keys = self._populated_keys()
+        return len(keys) > 0 if key is None else key in keys
+
+    def _acquire_lock(self, name, timeout=None):
+        lock = os.path.join(self.queue_dir, f"{name}.lock")
+
+        if acquire_lock(lock, stale_seconds=self.lease_seconds, timeout=0, worker=self.worker_id):
+            return lock
+
+        print(f"[Queue] Waiting for another worker to release the {name} lock at \"{self.queue_dir}\"...")
+        if not acquire_lock(lock, stale_seconds=self.lease_seconds, timeout=timeout, poll_seconds=1, worker=self.worker_id):
+            raise TimeoutError(f"Could not acquire the {name} lock of the queue at \"{self.queue_dir}\" after {timeout} seconds.")
+        return lock
+
+    @contextmanager
+    def locked(self, name, timeout=None):
+        """
+        Holds the lock 'name', shared by all the workers of the queue, while in the context. Locks left by workers
+        that stopped while holding them are removed. Raises TimeoutError if not acquired within 'timeout' seconds.
+
+        Example:
+            with queue.locked("aggregate"):
+                ...  # only one worker at a time
+        """
+        lock = self._acquire_lock(name, timeout)
+        try:
+            yield
+        finally:
+            release_lock(lock)
+
+    def populate(self, granules, key=None, timeout=None):
+        """
+        Adds the granules to the queue, skipping the ones already queued (in any state). Only the first worker to call
+        this function for a given 'key' populates the queue, the remaining workers wait for it to finish
+        (up to 'timeout' seconds, forever if None) and then return.
+
+        Args:
+            granules: list of (url, size) tuples, as returned by GEDIFinder.find, or a callable returning it.
+                      A callable is only evaluated by the worker that populates the queue.
+            key: Identifies the granule query (e.g. product, dates and ROI). A later run with a different key tops up
+                 the queue with its new granules. If None, the queue is only populated once.
+        Returns:
+            True if this worker populated the queue, False if it was already populated by another worker.
+        """
+        key = key if key is not None else "*"
+
+        # The lock is always released, so a failed populate (e.g. the Finder exits) can be retried by another worker
+        with self.locked("populate", timeout):
+            keys = self._populated_keys()
+            if key in keys or (key == "*" and keys):
+                return False
+
+            granules = granules() if callable(granules) else granules
+            known = set(f for state in self.STATES for f in self._list(state))
+
+            added = 0
+            for g in granules:
+                name = g[0].split("/")[-1].replace(".h5", ".json")
+                if name in known:
+                    continue
+                self._write(self._path("pending", name), {"url": g[0], "size": g[1], "attempts": 0})
+                known.add(name)
+                added += 1
+
+            with open(os.path.join(self.queue_dir, "populated"), "a") as mf:
+                mf.write(f"{key}\n")
+
+        print(f"[Queue] Added {added} granules to the queue at \"{self.queue_dir}\"")
+        return True
+
+    def reclaim_expired(self):
+        """
+        Returns every claimed task whose lease has expired (no heartbeat for 'lease_seconds') to pending.
+        """
+        reclaimed = 0
+        now = time.time()
+        for name in self._list("claimed"):
+            if name in self._held:
+                continue
+            try:
+                last_beat = os.path.getmtime(self._path("claimed", name))
+            except FileNotFoundError:
+                continue
+            if now - last_beat > self.lease_seconds and self._move("claimed", "pending", name):
+                print(f"[Queue] Lease expired for {name}. Returning it to the queue.")
+                reclaimed += 1
+        return reclaimed
+
+    def claim(self, poll_seconds=5):
+        """
+        Claims the next available granule from the queue, waiting for leases held by other workers
+        to be completed or to expire.
+
+        Returns:
+            The claimed task as a dict with keys {'url', 'size', 'attempts', 'worker'}, or None if the queue is empty.
+        """
+        while True:
+            self.reclaim_expired()
+
+            for name in self._list("pending"):
+                # Refresh the heartbeat before the move, so the claimed task is never seen as expired
+                try:
+                    os.utime(self._path("pending", name))
+                except FileNotFoundError:
+                    continue
+                if not self._move("pending", "claimed", name):
+                    continue
+
+                task = self._read(self._path("claimed", name))
+                task["attempts"] += 1
+
+                if task["attempts"] > self.max_attempts:
+                    print(f"[Queue] Granule {task['url']} failed {self.max_attempts} times. Moving to failed.")
+                    self._move("claimed", "failed", name)
+                    continue
+
+                task["worker"] = self.worker_id
+                task["name"] = name
+                self._write(self._path("claimed", name), task)
+
+                with self._lock:
+                    self._held[name] = task
+                self._start_heartbeat()
+                return task
+
+            # Nothing left to claim, the queue is finished when no other worker holds a lease
+            if not self._list("claimed"):
+                return None
+
+            time.sleep(poll_seconds)
+
+    def _owns(self, name):
+        """
+        Checks if the claimed task 'name' is still leased to this worker (it may have been reclaimed and claimed by another).
+        """
+        try:
+            return self._read(self._path("claimed", name)).get("worker") == self.worker_id
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def _finish(self, task, state):
+        with self._lock:
+            self._held.pop(task["name"], None)
+
+        if not self._owns(task["name"]) or not self._move("claimed", state, task["name"]):
+            print(f"[Queue] Lease for {task['url']} was lost before finishing.")
+            return False
+        return True
+
+    def complete(self, task):
+        """
+        Marks a claimed task as done.
+        """
+        return self._finish(task, "done")
+
+    def release(self, task):
+        """
+        Returns a claimed task to the queue, so it can be claimed again (by any worker).
+        """
+        return self._finish(task, "pending")
+
+    def _start_heartbeat(self):
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+
+    def _beat(self):
+        while not self._stop.wait(self.heartbeat_seconds):
+            with self._lock:
+                names = list(self._held)
+            for name in names:
+                try:
+                    if not self._owns(name):
+                        raise FileNotFoundError
+                    os.utime(self._path("claimed", name))
+                except FileNotFoundError:
+                    print(f"[Queue] Lease for {name} was reclaimed by another worker.")
+                    with self._lock:
+                        self._held.pop(name, None)
+
+    def close(self):
+        """
+        Stops the heartbeat thread. Leases still held are left to expire and be reclaimed.
+        """
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join()
+            self._heartbeat = None
+
+    def status(self):
+        """
+        Returns the number of tasks in each state of the queue.
+        """
+        return {state: len(self._list(state)) for state in self.STATES}
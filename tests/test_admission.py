@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import socket
+import multiprocessing
+
+from pipeline.admission import GEDIDiskBudget
+from pipeline.pipeline import GEDIPipeline
+
+
+def hold_reservation(directory, name, size, seconds, log_path):
+    disk = GEDIDiskBudget(directory, budget=100, min_free=0)
+    assert disk.reserve(name, size, timeout=30, poll_seconds=0.1)
+    with open(log_path, "a") as log:
+        log.write(f"{name} reserved {time.time()}\n")
+    time.sleep(seconds)
+    with open(log_path, "a") as log:
+        log.write(f"{name} released {time.time()}\n")
+    disk.release(name)
+    disk.close()
+
+
+def start(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def write_reservation(disk, name, size, host, pid):
+    with open(os.path.join(disk.reservations_dir, f"{name}.res"), "w") as rf:
+        json.dump({"host": host, "pid": pid, "size": size}, rf)
+
+
+def dead_pid():
+    process = start(time.sleep, 0)
+    process.join()
+    return process.pid
+
+
+def test_processes_share_the_budget(tmp_path):
+    directory, log_path = str(tmp_path), str(tmp_path / "log")
+
+    first = start(hold_reservation, directory, "GEDI_a.h5", 60, 1, log_path)
+    while not os.path.exists(log_path):
+        time.sleep(0.05)
+    second = start(hold_reservation, directory, "GEDI_b.h5", 60, 0, log_path)
+
+    for p in [first, second]:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+
+    with open(log_path) as log:
+        events = {tuple(line.split()[:2]): float(line.split()[2]) for line in log}
+
+    # Both reservations do not fit in the budget, the second waits for the first to be released
+    assert events[("GEDI_b.h5", "reserved")] >= events[("GEDI_a.h5", "released")]
+
+
+def test_reservation_is_counted_until_released(tmp_path):
+    disk = GEDIDiskBudget(str(tmp_path), budget=100, min_free=0)
+
+    assert disk.try_reserve("GEDI_a.h5", 60)
+    assert not disk.fits(60)
+    assert not disk.try_reserve("GEDI_b.h5", 60)
+    assert disk.try_reserve("GEDI_b.h5", 40)
+
+    disk.release("GEDI_a.h5")
+    assert disk.fits(60)
+    disk.close()
+
+
+def test_stale_reservations_are_dropped(tmp_path):
+    disk = GEDIDiskBudget(str(tmp_path), budget=100, min_free=0, stale_seconds=60)
+
+    write_reservation(disk, "GEDI_dead.h5", 60, socket.gethostname(), dead_pid())
+    write_reservation(disk, "GEDI_old.h5", 30, "other-host", 1)
+    os.utime(os.path.join(disk.reservations_dir, "GEDI_old.h5.res"), (0, 0))
+    write_reservation(disk, "GEDI_live.h5", 30, "other-host", 1)
+
+    assert disk._reservations() == {"GEDI_live.h5": 30}
+    assert sorted(os.listdir(disk.reservations_dir)) == ["GEDI_live.h5.res"]
+
+
+def test_heartbeat_keeps_reservations_alive(tmp_path):
+    disk = GEDIDiskBudget(str(tmp_path), budget=100, min_free=0, stale_seconds=0.3)
+    assert disk.try_reserve("GEDI_a.h5", 60)
+
+    path = os.path.join(disk.reservations_dir, "GEDI_a.h5.res")
+    os.utime(path, (0, 0))
+    time.sleep(0.3)
+    assert time.time() - os.path.getmtime(path) < 0.3
+    disk.close()
+
+
+def test_stale_lock_is_broken(tmp_path):
+    disk = GEDIDiskBudget(str(tmp_path), budget=100, min_free=0)
+    with open(disk.lock_path, "w") as lock:
+        json.dump({"host": socket.gethostname(), "pid": dead_pid()}, lock)
+
+    assert disk.try_reserve("GEDI_a.h5", 10)
+    assert not os.path.exists(disk.lock_path)
+    disk.close()
+
+
+def test_kept_files_exhaust_the_budget(tmp_path):
+    disk = GEDIDiskBudget(str(tmp_path), budget=100, min_free=0)
+    with open(tmp_path / "GEDI_kept.h5", "wb") as f:
+        f.write(b"x" * 80)
+
+    assert disk.is_exhausted(30)
+    assert not disk.is_exhausted(10)
+
+    # A download in progress may still free space
+    assert disk.try_reserve("GEDI_a.h5", 10)
+    assert not disk.is_exhausted(30)
+    disk.close()
+
+
+def test_admission_order_skips_when_kept_files_exhaust_the_budget(tmp_path):
+    pipeline = GEDIPipeline(str(tmp_path), "GEDI02_A", "002", "2020.01.01", "2020.12.31", None, [1, 0, 0, 1], None, None,
+                            keep_original_file=True, disk_budget=1, min_free_space=0, admission_timeout=60)
+    with open(tmp_path / "GEDI02_A_kept.h5", "wb") as f:
+        f.write(b"x" * 900000)
+
+    granules = [("https://data.example/GEDI02_A_1.h5", 0.5), ("https://data.example/GEDI02_A_2.h5", 0.05),
+                ("https://data.example/GEDI02_A_kept.h5", 0.9)]
+
+    start_time = time.time()
+    admitted = list(pipeline._admission_order(granules))
+
+    assert admitted == granules[1:]
+    assert time.time() - start_time < 5
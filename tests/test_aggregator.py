@@ -0,0 +1,142 @@
+import os
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+import geopandas as gp
+import pytest
+
+from pipeline.aggregator import GEDIAggregator, check_output
+from pipeline.pipeline import GEDIPipeline
+from pipeline.workqueue import GEDIWorkQueue
+
+ROI = [1, 0, 0, 1]
+
+
+def footprints(n, seed):
+    rng = np.random.default_rng(seed)
+    lons, lats = rng.uniform(-0.1, 1.1, n), rng.uniform(-0.1, 1.1, n)
+    values = rng.normal(100, 20, n)
+    values[::7] = -9999
+    return gp.GeoDataFrame({'agbd': values, 'rh_98': values / 10}, geometry=gp.points_from_xy(lons, lats), crs="EPSG:4326")
+
+
+def test_update_matches_pandas():
+    df = footprints(5000, 0)
+    aggregator = GEDIAggregator(ROI, "agbd,rh_98", resolution=0.1)
+    aggregator.update(df)
+
+    # Expected statistics with a plain pandas group by over the valid footprints inside the ROI
+    x, y = df.geometry.x, df.geometry.y
+    valid = df[(x >= 0) & (x < 1) & (y > 0) & (y <= 1) & (df['agbd'] != -9999)].copy()
+    valid['row'] = np.floor((1 - valid.geometry.y) / 0.1).astype(int)
+    valid['col'] = np.floor(valid.geometry.x / 0.1).astype(int)
+    expected = valid.groupby(['row', 'col'])['agbd'].agg(['count', 'mean', 'std', 'min', 'max'])
+
+    stats = aggregator.statistics()['agbd']
+    rows, cols = expected.index.get_level_values(0), expected.index.get_level_values(1)
+
+    assert stats['count'].sum() == len(valid)
+    np.testing.assert_array_equal(stats['count'][rows, cols], expected['count'])
+    np.testing.assert_allclose(stats['mean'][rows, cols], expected['mean'])
+    np.testing.assert_allclose(stats['std'][rows, cols], expected['std'] * np.sqrt((expected['count'] - 1) / expected['count']), atol=1e-6)
+    np.testing.assert_array_equal(stats['min'][rows, cols], expected['min'])
+    np.testing.assert_array_equal(stats['max'][rows, cols], expected['max'])
+    assert np.isnan(stats['mean'][stats['count'] == 0]).all()
+
+
+def test_merge_equals_single_pass():
+    first, second = footprints(1000, 1), footprints(1000, 2)
+
+    single = GEDIAggregator(ROI, ['agbd'], resolution=0.1)
+    single.update(pd.concat([first, second]))
+
+    merged = GEDIAggregator(ROI, ['agbd'], resolution=0.1)
+    merged.update(first)
+    other = GEDIAggregator(ROI, ['agbd'], resolution=0.1)
+    other.update(second)
+    merged.merge(other)
+
+    for a in ['count', 'min', 'max']:
+        np.testing.assert_array_equal(getattr(merged, a), getattr(single, a))
+    for a in ['sum', 'sumsq']:
+        np.testing.assert_allclose(getattr(merged, a), getattr(single, a))
+
+    with pytest.raises(ValueError):
+        merged.merge(GEDIAggregator(ROI, ['agbd'], resolution=0.05))
+
+
+def test_save_load_round_trip(tmp_path):
+    aggregator = GEDIAggregator(ROI, ['agbd', 'rh_98'], resolution=0.1)
+    aggregator.update(footprints(1000, 3))
+
+    path = str(tmp_path / "grid.npz")
+    aggregator.save(path)
+    loaded = GEDIAggregator.load(path)
+
+    assert loaded.variables == aggregator.variables
+    assert (loaded.width, loaded.height, loaded.resolution, loaded.nodata) == (10, 10, 0.1, -9999)
+    for a in ['count', 'sum', 'sumsq', 'min', 'max']:
+        np.testing.assert_array_equal(getattr(loaded, a), getattr(aggregator, a))
+
+
+def test_geotiff_output_needs_rasterio():
+    check_output("grid.npz")
+    try:
+        import rasterio
+    except ImportError:
+        with pytest.raises(ImportError):
+            check_output("grid.tif")
+
+
+NAMES = [f"GEDI02_A_2020001{i:06d}_O00001_01_T00001_02_003_01_V002" for i in range(12)]
+
+
+def pipeline(directory, resolution=0.1):
+    gedi = GEDIPipeline(directory, "GEDI02_A", "002", "2020.01.01", "2020.12.31", None, ROI, None, None,
+                        aggregate="agbd", aggregate_resolution=resolution)
+    gedi.finder.find = lambda **kwargs: [(f"https://data.example/{n}.h5", 1.0) for n in NAMES]
+    return gedi
+
+
+def run_worker(directory, worker_id, die_after=None):
+    if die_after is not None:
+        complete = GEDIWorkQueue.complete
+
+        def complete_and_die(queue, task):
+            complete(queue, task)
+            if queue.status()['done'] >= die_after:
+                os._exit(1)
+
+        GEDIWorkQueue.complete = complete_and_die
+
+    pipeline(directory).run_worker(worker_id=worker_id, lease_seconds=1)
+
+
+def test_workers_merge_grids_of_every_granule(tmp_path):
+    directory = str(tmp_path)
+    expected = GEDIAggregator(ROI, ['agbd'], resolution=0.1)
+    for i, n in enumerate(NAMES):
+        df = footprints(50, i)
+        df.to_file(os.path.join(directory, f"{n}.gpkg"))
+        expected.update(df)
+
+    # Grid of a previous query with another resolution, in the same queue
+    old_grids = os.path.join(directory, ".queue", "aggregate", "previous")
+    os.makedirs(old_grids)
+    pipeline(directory, resolution=0.05).aggregator.save(os.path.join(old_grids, "w0.npz"))
+
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=run_worker, args=(directory, "dying", 2))]
+    workers[0].start()
+    workers[0].join(timeout=60)
+    workers = [context.Process(target=run_worker, args=(directory, f"w{i}")) for i in range(2)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(timeout=60)
+        assert w.exitcode == 0
+
+    merged = GEDIAggregator.load(os.path.join(directory, "gedi_aggregate.npz"))
+    np.testing.assert_array_equal(merged.count, expected.count)
+    np.testing.assert_allclose(merged.sum, expected.sum)
@@ -0,0 +1,106 @@
+import os
+
+import numpy as np
+import pandas as pd
+import geopandas as gp
+from shapely.geometry import box, Polygon
+
+from pipeline.indexer import GEDIIndexer
+from pipeline.pipeline import GEDIPipeline
+
+DAYS = ["2020001", "2020100", "2020200"]
+
+
+def granule_name(day, i):
+    return f"GEDI02_A_{day}000000_O0000{i}_01_T00001_02_003_01_V002"
+
+
+def write_granules(directory):
+    """
+    Writes subsetted files with footprints along orbit-like tracks, ordered along the track as in GEDI granules.
+    """
+    rng = np.random.default_rng(0)
+    frames = []
+    for i, day in enumerate(DAYS):
+        t = np.sort(rng.uniform(0, 1, 2000))
+        lons, lats = 0.2 * i + t, 0.5 + 0.4 * np.sin(6 * t + i)
+        date = pd.to_datetime(day, format="%Y%j").strftime("%Y/%m/%d")
+        gdf = gp.GeoDataFrame({'agbd': rng.normal(100, 10, t.size), 'date': date}, geometry=gp.points_from_xy(lons, lats), crs="EPSG:4326")
+        gdf.to_file(os.path.join(directory, f"{granule_name(day, i)}.gpkg"))
+        frames.append(gdf.assign(source=f"{granule_name(day, i)}.gpkg"))
+    return pd.concat(frames, ignore_index=True)
+
+
+def brute_force(footprints, geometry, date_start=None, date_end=None):
+    match = footprints[footprints.geometry.intersects(geometry)]
+    dates = match['date'].str.replace('/', '.')
+    keep = np.ones(match.shape[0], dtype=bool)
+    if date_start is not None:
+        keep &= dates >= date_start
+    if date_end is not None:
+        keep &= dates <= date_end
+    return match[keep]
+
+
+def same_footprints(result, expected):
+    key = lambda df: sorted(zip(df['source'], df['agbd'].round(9)))
+    return (result is None and expected.shape[0] == 0) or key(result) == key(expected)
+
+
+def test_query_matches_brute_force(tmp_path):
+    footprints = write_granules(str(tmp_path))
+    indexer = GEDIIndexer(str(tmp_path), tile_size=0.05)
+    assert indexer.update() == 3
+
+    roi = [0.8, 0.3, 0.4, 0.7]
+    assert same_footprints(indexer.query(roi), brute_force(footprints, box(0.3, 0.4, 0.7, 0.8)))
+
+    triangle = Polygon([(0.1, 0.1), (1.2, 0.2), (0.5, 0.9)])
+    assert same_footprints(indexer.query(triangle), brute_force(footprints, triangle))
+
+    result = indexer.query(roi, date_start="2020.03.01", date_end="2020.05.01")
+    assert same_footprints(result, brute_force(footprints, box(0.3, 0.4, 0.7, 0.8), "2020.03.01", "2020.05.01"))
+    assert set(result['source']) == {f"{granule_name(DAYS[1], 1)}.gpkg"}
+    indexer.close()
+
+
+def test_plan_prunes_files_and_rows(tmp_path):
+    write_granules(str(tmp_path))
+    indexer = GEDIIndexer(str(tmp_path), tile_size=0.05)
+    indexer.update()
+
+    # Only the rows in tiles around the small ROI are read, merged into sorted, non overlapping ranges
+    plan = indexer.plan([0.6, 0.45, 0.5, 0.55])
+    assert 0 < sum(b - a for ranges in plan.values() for a, b in ranges) < 2000
+    for ranges in plan.values():
+        assert all(a < b <= c for (a, b), (c, _) in zip(ranges, ranges[1:]))
+
+    # Files outside the ROI or the dates are not read
+    assert indexer.plan([0.1, 5, 0, 6]) == {}
+    assert indexer.plan([1, 0, 0, 2], date_start="2021.01.01") == {}
+    indexer.close()
+
+
+def test_update_is_incremental(tmp_path):
+    write_granules(str(tmp_path))
+    indexer = GEDIIndexer(str(tmp_path))
+    indexer.update()
+
+    assert indexer.update() == 0
+
+    os.remove(os.path.join(str(tmp_path), f"{granule_name(DAYS[0], 0)}.gpkg"))
+    indexer.update()
+    assert indexer.db.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 2
+    indexer.close()
+
+
+def test_worker_indexes_when_queue_is_drained(tmp_path):
+    write_granules(str(tmp_path))
+    pipeline = GEDIPipeline(str(tmp_path), "GEDI02_A", "002", "2020.01.01", "2020.12.31", None, [1, 0, 0, 2], None, None, build_index=True)
+    pipeline.finder.find = lambda **kwargs: [(f"https://data.example/{granule_name(d, i)}.h5", 1.0) for i, d in enumerate(DAYS)]
+
+    pipeline.run_worker(worker_id="w0")
+
+    indexer = GEDIIndexer(str(tmp_path))
+    assert indexer.db.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 3
+    indexer.close()
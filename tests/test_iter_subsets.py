@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import geopandas as gp
+import pytest
+
+from pipeline.pipeline import GEDIPipeline
+
+NAME = "GEDI02_A_2020001000000_O00001_01_T00001_02_003_01_V002"
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    gedi = GEDIPipeline(str(tmp_path), "GEDI02_A", "002", "2020.01.01", "2020.12.31", None, [1, 0, 0, 1], None, None)
+    gedi.finder.find = lambda **kwargs: [(f"https://data.example/{NAME}.h5", 1.0)]
+
+    gdf = gp.GeoDataFrame({'agbd': np.arange(10.)}, geometry=gp.points_from_xy(np.linspace(0.1, 0.9, 10), [0.5] * 10), crs="EPSG:4326")
+    gdf.to_file(os.path.join(str(tmp_path), f"{NAME}.gpkg"))
+    return gedi
+
+
+def test_cached_subsets_are_streamed(pipeline):
+    results = list(pipeline.iter_subsets())
+
+    assert len(results) == 1
+    assert results[0]['cached'] and results[0]['rows'] == 10
+    assert results[0]['date'] == "2020/01/01"
+
+
+def test_arrow_output(pipeline):
+    pytest.importorskip("pyarrow")
+
+    batches = next(pipeline.iter_subsets(output="arrow", batch_size=4))['data']
+
+    assert [b.num_rows for b in batches] == [4, 4, 2]
+    assert "geometry" in batches[0].schema.names
+
+
+def test_output_is_checked_when_called(pipeline, monkeypatch):
+    with pytest.raises(ValueError):
+        pipeline.iter_subsets(output="csv")
+
+    # Missing pyarrow fails before any granule is processed
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ImportError):
+        pipeline.iter_subsets(output="arrow")
@@ -0,0 +1,172 @@
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+import requests
+
+from utils.retry import RetryPolicy, RetryError, AuthenticationError, TokenBucket, CircuitBreaker
+from pipeline.downloader import GEDIDownloader
+
+URL = "https://data.example/GEDI02_A_2020001000000_O00001_01_T00001_02_003_01_V002.h5"
+
+
+class FakeResponse:
+
+    def __init__(self, status_code=200, headers=None, chunks=None, fail_after=None):
+        self.status_code = status_code
+        self.headers = headers if headers is not None else {}
+        self.chunks = chunks if chunks is not None else []
+        self.fail_after = fail_after
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def iter_content(self, chunk_size=None):
+        for i, chunk in enumerate(self.chunks):
+            if self.fail_after is not None and i == self.fail_after:
+                raise requests.ConnectionError("Connection reset")
+            yield chunk
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """
+    Returns the given responses (or raises the given exceptions) in order, repeating the last one.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs)
+        response = self.responses[min(len(self.calls), len(self.responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    slept = []
+    monkeypatch.setattr(time, "sleep", slept.append)
+    return slept
+
+
+def test_retries_transient_failures(sleeps):
+    session = FakeSession(FakeResponse(503), requests.ConnectionError("refused"), FakeResponse(200))
+
+    response = RetryPolicy(retries=5).request(session, URL)
+
+    assert response.status_code == 200
+    assert len(session.calls) == 3
+    assert len(sleeps) == 2
+
+
+def test_gives_up_after_retries(sleeps):
+    session = FakeSession(FakeResponse(503))
+
+    with pytest.raises(RetryError):
+        RetryPolicy(retries=3, failure_threshold=100).request(session, URL)
+
+    assert len(session.calls) == 4
+
+
+def test_does_not_retry_authentication_and_client_errors(sleeps):
+    with pytest.raises(AuthenticationError):
+        RetryPolicy().request(FakeSession(FakeResponse(401)), URL)
+
+    session = FakeSession(FakeResponse(404))
+    assert RetryPolicy().request(session, URL).status_code == 404
+    assert len(session.calls) == 1
+    assert sleeps == []
+
+
+def test_default_timeout_can_be_overridden(sleeps):
+    session = FakeSession(FakeResponse(200))
+    policy = RetryPolicy(timeout=(1, 2))
+
+    policy.request(session, URL)
+    policy.request(session, URL, timeout=5)
+
+    assert [c["timeout"] for c in session.calls] == [(1, 2), 5]
+
+
+def test_retry_after_is_used_and_capped(sleeps):
+    policy = RetryPolicy(max_backoff=30)
+    in_a_minute = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=60), usegmt=True)
+
+    assert policy.retry_after(FakeResponse(503, {"Retry-After": "7"})) == 7
+    assert policy.retry_after(FakeResponse(503, {"Retry-After": "3600"})) == 30
+    assert policy.retry_after(FakeResponse(503, {"Retry-After": in_a_minute})) == 30
+    assert policy.retry_after(FakeResponse(503, {"Retry-After": "-5"})) == 0
+    assert policy.retry_after(FakeResponse(503, {"Retry-After": "soon"})) is None
+    assert policy.retry_after(FakeResponse(503)) is None
+
+    session = FakeSession(FakeResponse(429, {"Retry-After": "7"}), FakeResponse(200))
+    policy.request(session, URL)
+    assert sleeps == [7]
+
+
+def test_backoff_is_bounded():
+    policy = RetryPolicy(backoff=1, max_backoff=10)
+
+    for attempt in range(10):
+        assert 0 <= policy.backoff_delay(attempt) <= min(10, 2 ** attempt)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=20, capacity=1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+
+    # The first token is available right away, the next 4 come at 20 per second
+    assert time.monotonic() - start >= 0.18
+
+
+def test_circuit_breaker_opens_and_checks_status():
+    outage = [True]
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.05, status_check=lambda: outage[0])
+
+    breaker.record_failure()
+    assert breaker.remaining() == 0
+    breaker.record_failure()
+    assert breaker.remaining() > 0
+
+    # Stays open while the service status reports an outage
+    time.sleep(0.06)
+    assert breaker.remaining() > 0
+
+    outage[0] = False
+    time.sleep(0.06)
+    assert breaker.remaining() == 0
+
+    breaker.record_success()
+    assert breaker.failures == 0
+
+
+def test_failed_granule_request_is_not_retried_again(tmp_path, sleeps):
+    session = FakeSession(FakeResponse(503))
+    downloader = GEDIDownloader(save_path=str(tmp_path), retry_policy=RetryPolicy(retries=5, cooldown=0))
+    downloader._session = session
+
+    assert not downloader.download_granule_with_retries(URL)
+    assert len(session.calls) == 6
+
+
+def test_interrupted_download_is_restarted(tmp_path, sleeps):
+    chunks = [b"x" * 10] * 3
+    session = FakeSession(FakeResponse(200, {"content-length": "30"}, chunks, fail_after=1),
+                          FakeResponse(200, {"content-length": "30"}, chunks))
+    downloader = GEDIDownloader(save_path=str(tmp_path), retry_policy=RetryPolicy(retries=5))
+    downloader._session = session
+
+    assert downloader.download_granule_with_retries(URL)
+    assert len(session.calls) == 2
+    assert (tmp_path / URL.split("/")[-1]).stat().st_size == 30
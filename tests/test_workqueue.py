@@ -0,0 +1,117 @@
+import os
+import json
+import time
+import socket
+import multiprocessing
+
+import pytest
+
+from pipeline.workqueue import GEDIWorkQueue
+
+GRANULES = [(f"https://data.example/GEDI02_A_{i:04d}.h5", 1.0) for i in range(40)]
+
+
+def run_worker(queue_dir, worker_id, log_path, die_after=None):
+    queue = GEDIWorkQueue(queue_dir, worker_id=worker_id, lease_seconds=2, heartbeat_seconds=0.5)
+    queue.populate(GRANULES)
+
+    processed = 0
+    while (task := queue.claim(poll_seconds=0.2)) is not None:
+        if die_after is not None and processed == die_after:
+            os._exit(1)  # Die holding a lease
+        time.sleep(0.01)
+        if queue.complete(task):
+            with open(log_path, "a") as log:
+                log.write(f"{task['url']}\n")
+        processed += 1
+    queue.close()
+
+
+def failing_populate(queue_dir):
+    queue = GEDIWorkQueue(queue_dir, worker_id="failing")
+
+    def find():
+        exit(0)  # GEDIFinder.find exits when the query fails
+
+    queue.populate(find)
+
+
+def start(target, *args):
+    process = multiprocessing.get_context("fork").Process(target=target, args=args)
+    process.start()
+    return process
+
+
+def test_workers_process_every_granule_once(tmp_path):
+    queue_dir, log_path = str(tmp_path / "queue"), str(tmp_path / "log")
+
+    workers = [start(run_worker, queue_dir, f"w{i}", log_path) for i in range(3)]
+    workers.append(start(run_worker, queue_dir, "dying", log_path, 2))
+    for w in workers:
+        w.join(timeout=60)
+        assert w.exitcode is not None
+
+    with open(log_path) as log:
+        completed = log.read().split()
+
+    # The lease held by the dying worker is reclaimed and completed by another worker
+    assert sorted(completed) == sorted(g[0] for g in GRANULES)
+    assert GEDIWorkQueue(queue_dir).status() == {"pending": 0, "claimed": 0, "done": len(GRANULES), "failed": 0}
+
+
+def test_reclaimed_task_is_not_finished_by_previous_owner(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    first = GEDIWorkQueue(queue_dir, worker_id="first", lease_seconds=0.2, heartbeat_seconds=60)
+    second = GEDIWorkQueue(queue_dir, worker_id="second", lease_seconds=0.2, heartbeat_seconds=60)
+    first.populate(GRANULES[:1])
+
+    stale = first.claim()
+    time.sleep(0.3)
+    task = second.claim()
+    assert task["url"] == stale["url"]
+
+    assert not first.complete(stale)
+    assert not first.release(stale)
+    assert second.complete(task)
+    assert second.status()["done"] == 1
+
+    first.close()
+    second.close()
+
+
+def test_populate_lock_is_released_when_populate_fails(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+
+    process = start(failing_populate, queue_dir)
+    process.join(timeout=30)
+
+    queue = GEDIWorkQueue(queue_dir, worker_id="next")
+    assert not queue.is_populated()
+    assert queue.populate(GRANULES, timeout=5)
+    assert queue.status()["pending"] == len(GRANULES)
+
+
+def test_stale_populate_lock_is_removed(tmp_path):
+    queue_dir = str(tmp_path / "queue")
+    queue = GEDIWorkQueue(queue_dir, worker_id="next")
+
+    # Lock left by a process of this host that is no longer running
+    dead = start(time.sleep, 0)
+    dead.join()
+    with open(os.path.join(queue_dir, "populate.lock"), "w") as lock:
+        json.dump({"host": socket.gethostname(), "pid": dead.pid}, lock)
+
+    assert queue.populate(GRANULES, timeout=5)
+
+
+def test_populate_tops_up_with_new_query(tmp_path):
+    queue = GEDIWorkQueue(str(tmp_path / "queue"))
+
+    assert queue.populate(GRANULES[:10], key="2020")
+    assert not queue.populate(GRANULES[:10], key="2020")
+    assert queue.populate(GRANULES[5:20], key="2021")
+    assert queue.status()["pending"] == 20
+
+    with pytest.raises(TimeoutError):
+        open(os.path.join(queue.queue_dir, "populate.lock"), "w").close()
+        queue.populate(GRANULES, key="2022", timeout=1)
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import socket
+
+"""
+Lock files shared by processes of one or several machines through a (shared) filesystem.
+"""
+
+def owner(**extra):
+    """
+    Returns a dict identifying this process (hostname and process id), with any 'extra' fields, to write in a lock file.
+    """
+    return {"host": socket.gethostname(), "pid": os.getpid(), **extra}
+
+
+def read_owner(path):
+    """
+    Returns the owner written in a lock file, or None if the file has no (valid) owner.
+    Raises FileNotFoundError if the file does not exist.
+    """
+    with open(path, "r") as lf:
+        try:
+            info = json.load(lf)
+        except ValueError:
+            return None
+    return info if isinstance(info, dict) else None
+
+
+def owner_is_dead(info):
+    """
+    Checks if the owner process of a lock file stopped. Only processes of this host can be checked.
+    """
+    if info is None or info.get("host") != socket.gethostname():
+        return False
+    try:
+        os.kill(int(info.get("pid")), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, TypeError, ValueError, OverflowError):
+        pass
+    return False
+
+
+def _stale_stat(path, stale_seconds):
+    """
+    Returns the stat of the file at 'path' if it was left by a process that stopped: a process of this host that
+    is no longer running, or a process of another host (or unknown) that did not touch it for 'stale_seconds'.
+    Returns None otherwise.
+    """
+    try:
+        stat = os.stat(path)
+        info = read_owner(path)
+    except FileNotFoundError:
+        return None
+
+    if owner_is_dead(info):
+        return stat
+
+    # Processes of this host are trusted while running
+    if info is not None and info.get("host") == socket.gethostname():
+        return None
+
+    return stat if time.time() - stat.st_mtime > stale_seconds else None
+
+
+def remove_if_stale(path, stale_seconds):
+    """
+    Removes the file at 'path' if it is stale (see _stale_stat). The file is first moved away with an atomic rename,
+    so only one process removes it, and put back if it was replaced by a live one between the check and the rename.
+    Returns True if the file was removed.
+    """
+    stat = _stale_stat(path, stale_seconds)
+    if stat is None:
+        return False
+
+    moved = f"{path}.stale.{socket.gethostname()}.{os.getpid()}"
+    try:
+        os.rename(path, moved)
+    except FileNotFoundError:
+        return False
+
+    moved_stat = os.stat(moved)
+    if (moved_stat.st_ino, moved_stat.st_mtime_ns) != (stat.st_ino, stat.st_mtime_ns):
+        try:
+            os.link(moved, path)
+        except FileExistsError:
+            pass
+        os.remove(moved)
+        return False
+
+    os.remove(moved)
+    return True
+
+
+def acquire_lock(path, stale_seconds=60, timeout=None, poll_seconds=0.05, **extra):
+    """
+    Creates the lock file at 'path', waiting while another process holds it. Locks left by stopped processes are removed.
+
+    Args:
+        stale_seconds: Seconds after which a lock of another host is considered left behind.
+        timeout: Maximum seconds to wait for the lock. If None, waits forever.
+        extra: Additional fields written to the lock file.
+    Returns:
+        True if the lock was acquired, False if the timeout expired first.
+    """
+    start = time.time()
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if remove_if_stale(path, stale_seconds):
+                continue
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            time.sleep(poll_seconds)
+            continue
+
+        with os.fdopen(fd, "w") as lf:
+            json.dump(owner(**extra), lf)
+        return True
+
+
+def release_lock(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
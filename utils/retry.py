@@ -0,0 +1,234 @@
+import time
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+# Status codes caused by invalid or missing credentials, retrying does not help
+AUTH_STATUS = [401, 403]
+
+
+class AuthenticationError(Exception):
+    """
+    Raised when the Data Repository refuses the credentials of the Login session.
+    """
+
+
+class RetryError(Exception):
+    """
+    Raised when a request keeps failing after all the retries of a RetryPolicy.
+    """
+
+
+class TokenBucket:
+    """
+    The TokenBucket :class: limits the rate of requests sent to a host.
+
+    Args:
+        rate: Sustained number of requests per second.
+        capacity: Maximum number of requests sent in a burst. Defaults to 'rate' (at least 1).
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, waiting until one is available.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    The CircuitBreaker :class: stops sending requests to a host after several consecutive failures.
+    The breaker stays open for 'cooldown' seconds, then lets a single request through to check if the host recovered.
+
+    Args:
+        failure_threshold: Number of consecutive failures that open the breaker.
+        cooldown: Seconds the breaker stays open.
+        status_check: Optional function called before closing the breaker again. If it returns True (e.g. the DAAC
+                      announces an outage through its service status notices), the breaker stays open for another cooldown.
+    """
+
+    def __init__(self, failure_threshold=5, cooldown=300, status_check=None):
+        self.failure_threshold = failure_threshold
+        self.cooldown = float(cooldown)
+        self.status_check = status_check
+        self.failures = 0
+        self.open_until = None
+
+    def remaining(self):
+        """
+        Returns the seconds left before the breaker lets requests through, 0 if it is closed.
+        """
+        if self.open_until is None:
+            return 0
+
+        remaining = self.open_until - time.monotonic()
+        if remaining > 0:
+            return remaining
+
+        # Cooldown is over, check the service status before trying the host again
+        if self.status_check is not None and self.status_check():
+            print(f"[Retry] Service status reports an outage. Waiting another {self.cooldown:.0f} seconds...")
+            self.open_until = time.monotonic() + self.cooldown
+            return self.cooldown
+
+        self.open_until = None
+        return 0
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold and self.open_until is None:
+            print(f"[Retry] {self.failures} consecutive failures. Pausing requests for {self.cooldown:.0f} seconds...")
+            self.open_until = time.monotonic() + self.cooldown
+
+
+class RetryPolicy:
+    """
+    The RetryPolicy :class: sends HTTP requests with retries, shared by the GEDIFinder (CMR) and GEDIDownloader (DAAC) requests.
+
+    Failed requests (connection errors and 429/5xx responses) are retried with exponential backoff and jitter,
+    waiting the 'Retry-After' time instead when the server provides one (up to 'max_backoff'). Authentication failures (401/403) are not retried.
+    Requests to each host go through a token bucket rate limiter (if 'rate' is provided) and a circuit breaker.
+
+    Args:
+        retries: Number of retries for each request. Defaults to 5.
+        backoff: Base delay in seconds of the exponential backoff. Defaults to 1 second.
+        max_backoff: Maximum delay in seconds between retries. Defaults to 120 seconds.
+        rate: Maximum number of requests per second sent to each host. If None, requests are not rate limited.
+        failure_threshold: Number of consecutive failures to a host that open its circuit breaker.
+        cooldown: Seconds a circuit breaker stays open.
+        status_check: Optional function called before a circuit breaker closes, see CircuitBreaker.
+        timeout: (connect, read) timeout in seconds of each request, so a stalled connection fails and is retried
+                 instead of hanging. Used unless the caller passes its own 'timeout'. Defaults to (10, 60) seconds.
+
+    Example:
+        policy = RetryPolicy(retries=5, rate=2)
+        response = policy.request(session, "https://cmr.earthdata.nasa.gov/search/granules.json?...")
+    """
+
+    def __init__(self, retries=5, backoff=1.0, max_backoff=120, rate=None, failure_threshold=5, cooldown=300, status_check=None,
+                 timeout=(10, 60)):
+        self.retries = retries
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.rate = rate
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.status_check = status_check
+        self.timeout = timeout
+
+        self._buckets = {}
+        self._breakers = {}
+
+    def _host_state(self, url):
+        host = urlparse(url).hostname
+
+        if host not in self._breakers:
+            self._breakers[host] = CircuitBreaker(self.failure_threshold, self.cooldown, self.status_check)
+            self._buckets[host] = TokenBucket(self.rate) if self.rate else None
+
+        return self._buckets[host], self._breakers[host]
+
+    def backoff_delay(self, attempt):
+        """
+        Returns the delay before retry number 'attempt' (starting at 0), with full jitter.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def retry_after(self, response):
+        """
+        Returns the delay in seconds requested by the 'Retry-After' header of a response, capped to 'max_backoff'
+        so a misbehaving server cannot stall the pipeline. Returns None if not provided.
+        """
+        value = response.headers.get('Retry-After')
+        if value is None:
+            return None
+
+        try:
+            delay = float(value)
+        except ValueError:
+            try:
+                delay = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+            except (TypeError, ValueError):
+                return None
+
+        return min(self.max_backoff, max(0.0, delay))
+
+    def request(self, session, url, method="GET", **kwargs):
+        """
+        Sends a request through 'session' (a requests.Session, or the requests module) following the policy.
+
+        Returns:
+            the response of the first attempt that was not a transient failure. The caller must still check
+            the response status for errors that are not retried (e.g. 404).
+        Raises:
+            AuthenticationError: if the server refuses the credentials (401/403).
+            RetryError: if the request still fails after all retries.
+        """
+        bucket, breaker = self._host_state(url)
+        error = None
+        kwargs.setdefault('timeout', self.timeout)
+
+        for attempt in range(self.retries + 1):
+            wait = breaker.remaining()
+            if wait > 0:
+                time.sleep(wait)
+
+            if bucket is not None:
+                bucket.acquire()
+
+            delay = None
+            try:
+                response = session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code in AUTH_STATUS:
+                    raise AuthenticationError(f"Request to {url} refused with status {response.status_code}.")
+
+                if response.status_code not in RETRY_STATUS:
+                    breaker.record_success()
+                    return response
+
+                error = f"status {response.status_code}"
+                delay = self.retry_after(response)
+                response.close()
+
+            breaker.record_failure()
+
+            if attempt == self.retries:
+                break
+
+            delay = delay if delay is not None else self.backoff_delay(attempt)
+            print(f"[Retry] Request to {urlparse(url).hostname} failed ({error}). Retrying in {delay:.1f} seconds ({attempt + 1}/{self.retries})...")
+            time.sleep(delay)
+
+        raise RetryError(f"Request to {url} failed after {self.retries} retries ({error}).")
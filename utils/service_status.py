@@ -1,14 +1,18 @@
 
 # Link URL curl --request GET --url 'https://status.earthdata.nasa.gov/api/v1/notifications?client=LP%20DAAC%20Website%20(OPS)&alll=true'
 
+import re
+from datetime import datetime, timezone
+
 import requests
-from bs4 import BeautifulSoup
 
 product_provider_lookup = {}
 
-def get_service_status(product):
+def get_service_status(product, timeout=(10, 30), quiet=False):
     """
-    Prints to the console the service status of the Data Repository Provider through NASA's Status REST API
+    Prints to the console the service status of the Data Repository Provider through NASA's Status REST API.
+    Returns an empty list if the Status API cannot be reached within 'timeout' (connect, read) seconds.
+    If 'quiet' is True, the notifications are only returned, not printed.
     """
 
     link = 'https://status.earthdata.nasa.gov/api/v1/notifications?client=LP%20DAAC%20Website%20(OPS)&alll=true'
@@ -17,9 +21,19 @@ def get_service_status(product):
     if product in ["GEDI04_A"]:
         link = 'https://status.earthdata.nasa.gov/api/v1/notifications?client=ORNL%20DAAC%20Website%20(OPS)&alll=true'
 
-    notifications_list = requests.get(link).json()['notifications']
+    try:
+        notifications_list = requests.get(link, timeout=timeout).json()['notifications']
+    except (requests.RequestException, ValueError, KeyError) as e:
+        if not quiet:
+            print(f"[Service Status] Could not get the service status: {e}")
+        return []
+
+    if quiet:
+        return notifications_list
 
     if len(notifications_list) > 0:
+        from bs4 import BeautifulSoup
+
         for notif in notifications_list:
             id_num = notif['id']
             message = BeautifulSoup(notif['message'], features="html.parser").get_text()
@@ -30,6 +44,48 @@ def get_service_status(product):
         return notifications_list
 
 
+# Phrases of a service notice announcing the Data Repository is unavailable right now. Notices of scheduled or
+# past maintenance (e.g. "will be unavailable", "has been restored") do not match
+outage_keywords = re.compile(
+    r"\b(currently|temporarily|now) (unavailable|down|offline|degraded|experiencing)\b"
+    r"|\b(ongoing|unplanned|unscheduled|current|active) (outage|interruption|disruption)s?\b"
+    r"|\b(is|are) (unavailable|down|offline|degraded)\b"
+    r"|\boutage in progress\b"
+)
+
+# Fields of a notice that may hold the period it is in effect
+start_fields = ['start_time', 'start_date', 'start', 'starts_at']
+end_fields = ['end_time', 'end_date', 'end', 'ends_at']
+
+def _notice_time(notif, fields):
+    for field in fields:
+        value = notif.get(field)
+        if not value:
+            continue
+        try:
+            time = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            continue
+        return time if time.tzinfo is not None else time.replace(tzinfo=timezone.utc)
+    return None
+
+def has_outage_notice(notifications_list):
+    """
+    Checks if any of the notifications returned by get_service_status announces an outage of the Data Repository
+    in effect right now. Notices with a start or end time outside the current time are ignored.
+    """
+    now = datetime.now(timezone.utc)
+
+    for notif in notifications_list:
+        start, end = _notice_time(notif, start_fields), _notice_time(notif, end_fields)
+        if (start is not None and start > now) or (end is not None and end < now):
+            continue
+
+        if outage_keywords.search(re.sub(r"<[^>]+>", " ", notif.get('message', '')).lower()):
+            return True
+    return False
+
+
 if __name__ == '__main__':
     # TEST
     get_service_status("GEDI02_A")
\ No newline at end of file